@@ -0,0 +1,52 @@
+# python -m benchmarks.audio_extract clip.mp4 [...]  (from the agrobot directory)
+# the moviepy baseline needs `pip install moviepy==1.0.3`, it is no longer a bot dependency
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import time
+
+from src.nn.audio_extract import extract_audio
+
+
+def moviepy_audio(path: str) -> io.BytesIO:
+    # the old path: import moviepy, write mp3 to a temp file, read it back
+    from moviepy.editor import VideoFileClip
+
+    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_audio:
+        name = temp_audio.name
+    try:
+        clip = VideoFileClip(path)
+        clip.audio.write_audiofile(name, codec="mp3", bitrate="32k", logger=None)
+        clip.audio.close()
+        clip.close()
+        with open(name, "rb") as f:
+            return io.BytesIO(f.read())
+    finally:
+        os.remove(name)
+
+
+async def main(paths):
+    for path in paths:
+        started = time.perf_counter()
+        audio = await extract_audio(path)
+        ffmpeg_s = time.perf_counter() - started
+        print(path)
+        print(f"  ffmpeg pipe (opus 16k mono): {ffmpeg_s:6.2f} s, {len(audio.getvalue()) / 1024:8.0f} KiB")
+
+        started = time.perf_counter()
+        try:
+            audio = moviepy_audio(path)
+        except ImportError:
+            print("  moviepy not installed, baseline skipped")
+            continue
+        moviepy_s = time.perf_counter() - started
+        print(f"  moviepy write_audiofile:     {moviepy_s:6.2f} s, {len(audio.getvalue()) / 1024:8.0f} KiB "
+              f"(including import)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python -m benchmarks.audio_extract clip.mp4 [...]")
+    asyncio.run(main(sys.argv[1:]))
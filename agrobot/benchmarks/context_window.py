@@ -0,0 +1,52 @@
+# python -m benchmarks.context_window  (from the agrobot directory)
+import time
+
+from src.nn.context_window import ContextWindow, message_text
+from src.nn.tokens import count_tokens
+
+N_TURNS = 100
+
+
+def make_dialog(n_turns: int):
+    question = "Почему на листьях огурцов появились жёлтые пятна и как их лечить? "
+    answer = "Это похоже на ложную мучнистую росу. Обработайте растения фунгицидом и снизьте влажность. " * 6
+    return [{"user": [{"type": "text", "text": f"{i}. {question}"}], "bot": f"{i}. {answer}"}
+            for i in range(n_turns)]
+
+
+def fit_per_message(window: ContextWindow, dialog_messages):
+    # the old approach: count the whole prompt again after every dropped turn
+    n_removed = 0
+    while n_removed < len(dialog_messages):
+        kept = dialog_messages[n_removed:]
+        n_tokens = sum(window.tokens_per_message * 2 + count_tokens(message_text(turn["user"]), window.model) +
+                       count_tokens(message_text(turn["bot"]), window.model) for turn in kept)
+        if n_tokens <= window.budget:
+            break
+        n_removed += 1
+    return dialog_messages[n_removed:], n_removed
+
+
+def timed(function, *args, n_rounds: int = 20):
+    started = time.perf_counter()
+    for _ in range(n_rounds):
+        result = function(*args)
+    return result, 1000 * (time.perf_counter() - started) / n_rounds
+
+
+def main():
+    dialog = make_dialog(N_TURNS)
+    window = ContextWindow("gpt-4o", budget=8000)
+
+    (kept, n_removed), fit_ms = timed(window.fit, dialog)
+    (kept_old, n_removed_old), old_ms = timed(fit_per_message, window, dialog)
+
+    n_total = sum(window.count_turns(dialog))
+    print(f"{N_TURNS} turns, {n_total} tokens, budget {window.budget}")
+    print(f"ContextWindow.fit: kept {len(kept)}, removed {n_removed}, {fit_ms:.2f} ms")
+    print(f"recount per dropped turn: kept {len(kept_old)}, removed {n_removed_old}, {old_ms:.2f} ms")
+    print(f"tokens sent: {sum(window.count_turns(kept))} instead of {n_total}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# python -m benchmarks.tokens  (from the agrobot directory)
+import timeit
+
+import tiktoken
+
+from src.nn.tokens import count_tokens, count_tokens_batch, count_message_tokens, get_encoding
+
+TEXT = "Чем обработать картофель от колорадского жука в период цветения? " * 4
+MESSAGES = [{"role": "user" if i % 2 == 0 else "assistant", "content": TEXT} for i in range(50)]
+
+
+def uncached_count(text: str, model: str = "gpt-4o"):
+    # what every call did before: resolve the encoding each time
+    return len(tiktoken.encoding_for_model(model).encode(text))
+
+
+def loop_count(texts):
+    return [count_tokens(text) for text in texts]
+
+
+def report(name: str, statement, number: int):
+    seconds = min(timeit.repeat(statement, number=number, repeat=5)) / number
+    print(f"{name:<40} {1e6 * seconds:10.1f} us/call")
+
+
+def main():
+    get_encoding("gpt-4o")
+    texts = [message["content"] for message in MESSAGES]
+
+    report("encoding_for_model + encode", lambda: uncached_count(TEXT), 2000)
+    report("count_tokens (cached encoding)", lambda: count_tokens(TEXT), 2000)
+    report("count_tokens x50 in a loop", lambda: loop_count(texts), 200)
+    report("count_tokens_batch x50", lambda: count_tokens_batch(texts), 200)
+    report("count_message_tokens (50 messages)", lambda: count_message_tokens(MESSAGES), 200)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# python -m benchmarks.video_frames [clip.mp4 ...]  (from the agrobot directory)
+import base64
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from src.nn.video_frames import sample_frames, LOW_DETAIL_SIZE
+
+
+def seek_frames(path: str, seconds_per_frame: float = 1.0):
+    # the old path: re-seek before every read, full-size JPEG, base64 inline
+    video = cv2.VideoCapture(path)
+    total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames_to_skip = int(video.get(cv2.CAP_PROP_FPS) * seconds_per_frame)
+
+    frames = []
+    curr_frame = 0
+    while curr_frame < total_frames - 1:
+        video.set(cv2.CAP_PROP_POS_FRAMES, curr_frame)
+        success, frame = video.read()
+        if not success:
+            break
+        _, buffer = cv2.imencode(".jpg", frame)
+        frames.append(base64.b64encode(buffer).decode("utf-8"))
+        curr_frame += frames_to_skip
+    video.release()
+    return frames
+
+
+def make_clip(path: str, seconds: int = 60, fps: int = 30, size=(1280, 720)):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    rng = np.random.default_rng(0)
+    scene = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    for i in range(seconds * fps):
+        if i % (10 * fps) == 0:
+            scene = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+        writer.write(np.roll(scene, i, axis=1))
+    writer.release()
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def main(paths):
+    for path in paths:
+        old, old_s = timed(seek_frames, path)
+        new, new_s = timed(sample_frames, path, 1.0, LOW_DETAIL_SIZE, 80)
+
+        print(path)
+        print(f"  seek per frame:    {len(old):4d} frames, {old_s:6.2f} s, "
+              f"{sum(map(len, old)) / 1024:8.0f} KiB base64")
+        print(f"  sequential + 512px: {len(new.frames):4d} frames, {new_s:6.2f} s, "
+              f"{sum(map(len, new.frames)) * 4 / 3 / 1024:8.0f} KiB base64")
+
+
+if __name__ == "__main__":
+    clips = sys.argv[1:]
+    if clips:
+        main(clips)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            clip = os.path.join(directory, "synthetic.mp4")
+            make_clip(clip)
+            main([clip])
@@ -0,0 +1,103 @@
+# python -m benchmarks.voice_intent  (from the agrobot directory)
+# the remote gpt-3.5 baseline runs only when OPENAI_API_KEY is set
+import asyncio
+import time
+
+import openai
+
+from src.config import Config
+from src.nn.openai_api import OpenAIHelper
+from src.nn.voice_intent import VoiceIntentDetector
+from tests.voice_intent_cases import VOICE_INTENT_CASES
+
+REMOTE_MODEL = "gpt-3.5-turbo"
+
+
+class Scores:
+    def __init__(self, name: str):
+        self.name = name
+        self.n_cases = self.n_correct = 0
+        self.true_pos = self.false_pos = self.false_neg = 0
+        self.latencies = []
+
+    def add(self, is_voice: bool, expected: bool, seconds: float):
+        self.n_cases += 1
+        self.n_correct += is_voice == expected
+        self.true_pos += is_voice and expected
+        self.false_pos += is_voice and not expected
+        self.false_neg += not is_voice and expected
+        self.latencies.append(seconds)
+
+    def row(self) -> str:
+        latencies = sorted(self.latencies)
+        mean_ms = 1000 * sum(latencies) / len(latencies)
+        p95_ms = 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return f"{self.name:<20} {self.n_correct / self.n_cases:>9.1%} " \
+               f"{self.true_pos / max(1, self.true_pos + self.false_pos):>10.1%} " \
+               f"{self.true_pos / max(1, self.true_pos + self.false_neg):>8.1%} " \
+               f"{mean_ms:>10.3f} {p95_ms:>10.3f}"
+
+
+async def remote_is_voice(client: openai.AsyncOpenAI, message: str) -> bool:
+    # the classification call is_need_voice made for every message before the local detector
+    r = await client.chat.completions.create(model=REMOTE_MODEL,
+                                             messages=await OpenAIHelper.is_need_voice_message(message),
+                                             temperature=0.0)
+    answer = r.choices[0].message.content
+    return bool(int(answer)) if answer in ["0", "1"] else False
+
+
+async def remote_scores(detector: VoiceIntentDetector):
+    client = openai.AsyncOpenAI(api_key=Config.openai_api_key)
+    remote, hybrid = Scores(f"remote {REMOTE_MODEL}"), Scores("local + fallback")
+    n_fallbacks = 0
+
+    for message, expected in VOICE_INTENT_CASES:
+        started = time.perf_counter()
+        is_voice = await remote_is_voice(client, message)
+        remote_seconds = time.perf_counter() - started
+        remote.add(is_voice, expected, remote_seconds)
+
+        # what is_need_voice does now: the LLM is asked only when the detector is unsure
+        started = time.perf_counter()
+        local_voice, confidence = detector(message)
+        local_seconds = time.perf_counter() - started
+        if confidence >= Config.voice_intent_confidence:
+            hybrid.add(local_voice, expected, local_seconds)
+        else:
+            n_fallbacks += 1
+            hybrid.add(is_voice, expected, local_seconds + remote_seconds)
+
+    return remote, hybrid, n_fallbacks
+
+
+def main(n_rounds: int = 1000):
+    detector = VoiceIntentDetector(Config.voice_intent_model_path)
+
+    local = Scores("local")
+    n_confident = 0
+    for message, expected in VOICE_INTENT_CASES:
+        is_voice, confidence = detector(message)
+        n_confident += confidence >= Config.voice_intent_confidence
+        started = time.perf_counter()
+        for _ in range(n_rounds):
+            detector(message)
+        local.add(is_voice, expected, (time.perf_counter() - started) / n_rounds)
+
+    print(f"cases: {len(VOICE_INTENT_CASES)}")
+    print(f"{'':<20} {'accuracy':>9} {'precision':>10} {'recall':>8} {'mean ms':>10} {'p95 ms':>10}")
+    print(local.row())
+    print(f"answered locally with confidence: {n_confident / len(VOICE_INTENT_CASES):.1%}")
+
+    if not Config.openai_api_key:
+        print(f"remote {REMOTE_MODEL}: skipped, OPENAI_API_KEY is not set")
+        return
+
+    remote, hybrid, n_fallbacks = asyncio.run(remote_scores(detector))
+    print(remote.row())
+    print(hybrid.row())
+    print(f"sent to the LLM by the fallback: {n_fallbacks} of {len(VOICE_INTENT_CASES)}")
+
+
+if __name__ == "__main__":
+    main()
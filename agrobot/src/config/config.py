@@ -23,6 +23,45 @@ class config:
         }
         self.n_rate_per_page = int(os.getenv("N_RATE_PER_PAGE", 5))
         self.new_dialog_timeout = int(os.getenv("NEW_DIALOG_TIMEOUT", 3600))
+        self.max_dialog_messages = int(os.getenv("MAX_DIALOG_MESSAGES", 50))
+        self.context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", 8000))
+        self.context_token_budgets = json.loads(os.getenv("CONTEXT_TOKEN_BUDGETS", "{}"))
+        self.answer_cache_ttl = int(os.getenv("ANSWER_CACHE_TTL", 7 * 24 * 3600))
+        self.answer_cache_max_entries = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 5000))
+        self.answer_cache_max_prompt_length = int(os.getenv("ANSWER_CACHE_MAX_PROMPT_LENGTH", 300))
+        self.file_lookup_concurrency = int(os.getenv("FILE_LOOKUP_CONCURRENCY", 8))
+        self.video_frame_workers = int(os.getenv("VIDEO_FRAME_WORKERS", 2))
+        self.video_frame_max_side = int(os.getenv("VIDEO_FRAME_MAX_SIDE", 512))
+        self.video_frame_jpeg_quality = int(os.getenv("VIDEO_FRAME_JPEG_QUALITY", 80))
+        self.video_max_frames = int(os.getenv("VIDEO_MAX_FRAMES", 10))
+        self.video_scene_threshold = float(os.getenv("VIDEO_SCENE_THRESHOLD", 0.2))
+        self.ffmpeg_path = os.getenv("FFMPEG_PATH", "ffmpeg")
+        self.audio_bitrate = os.getenv("AUDIO_BITRATE", "24k")
+        self.silence_noise_db = float(os.getenv("SILENCE_NOISE_DB", -30))
+        self.silence_min_duration = float(os.getenv("SILENCE_MIN_DURATION", 0.5))
+        self.transcribe_chunk_seconds = float(os.getenv("TRANSCRIBE_CHUNK_SECONDS", 600))
+        self.transcribe_concurrency = int(os.getenv("TRANSCRIBE_CONCURRENCY", 4))
+        self.transcribe_retries = int(os.getenv("TRANSCRIBE_RETRIES", 3))
+        self.dialog_ttl = int(os.getenv("DIALOG_TTL", 90 * 24 * 3600))
+        self.payment_ttl = int(os.getenv("PAYMENT_TTL", 7 * 24 * 3600))
+        self.db_batch_size = int(os.getenv("DB_BATCH_SIZE", 1000))
+        self.stats_top_n = int(os.getenv("STATS_TOP_N", 20))
+        self.broadcast_rate = float(os.getenv("BROADCAST_RATE", 30))
+        self.broadcast_chat_interval = float(os.getenv("BROADCAST_CHAT_INTERVAL", 1.0))
+        self.broadcast_concurrency = int(os.getenv("BROADCAST_CONCURRENCY", 10))
+        self.broadcast_batch_size = int(os.getenv("BROADCAST_BATCH_SIZE", 100))
+        self.broadcast_progress_interval = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", 5.0))
+        self.stream_edit_tokens = int(os.getenv("STREAM_EDIT_TOKENS", 40))
+        self.stream_edit_interval = float(os.getenv("STREAM_EDIT_INTERVAL", 1.5))
+        self.stream_min_edit_gap = float(os.getenv("STREAM_MIN_EDIT_GAP", 1.0))
+        self.voice_intent_model_path = os.getenv("VOICE_INTENT_MODEL_PATH")
+        self.voice_intent_confidence = float(os.getenv("VOICE_INTENT_CONFIDENCE", 0.8))
+        self.http_timeout = float(os.getenv("HTTP_TIMEOUT", 30.0))
+        self.http_connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5.0))
+        self.http_max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+        self.http_max_keepalive = int(os.getenv("HTTP_MAX_KEEPALIVE", 20))
+        self.http_keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30.0))
+        self.openai_timeout = float(os.getenv("OPENAI_TIMEOUT", 600.0))
         self.proxies = os.getenv("PROXIES", "").split()
         self.tts_model = os.getenv("TTS_MODEL", "tts-1")
         self.tts_voice = os.getenv("TTS_VOICE", "cove")
@@ -49,6 +88,11 @@ class config:
         self.TRANSCRIBE_SECOND_COST = float(os.getenv("TRANSCRIBE_SECOND_COST", 0.0001))
         self.GENERATE_SECOND_COST = float(os.getenv("GENERATE_SECOND_COST", 0.000015))
         self.admins_ids = list(map(int, os.getenv("ADMINS_IDS", "5484401110").split(',')))
+        self.admin_cache_ttl = int(os.getenv("ADMIN_CACHE_TTL", 300))
+        self.rate_cache_ttl = int(os.getenv("RATE_CACHE_TTL", 300))
+        self.renewal_retry_interval = int(os.getenv("RENEWAL_RETRY_INTERVAL", 3600))
+        self.renewal_sweep_interval = int(os.getenv("RENEWAL_SWEEP_INTERVAL", 600))
+        self.renewal_max_attempts = int(os.getenv("RENEWAL_MAX_ATTEMPTS", 3))
 
     # def validate_doc_path(self):
     #     os.makedirs(self.doc_path, exist_ok=True)
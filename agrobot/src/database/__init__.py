@@ -1,2 +1,2 @@
 # from .database import DataBase # old version
-from .async_database import DataBase
+from .async_database import DataBase, UserSnapshot
@@ -1,18 +1,113 @@
 import motor.motor_asyncio as amotor
+from pymongo import UpdateOne
 from typing import Optional, Any, List
 import uuid
-from datetime import datetime
+import copy
+import time
+from datetime import datetime, timedelta
 from src.config import Config
 from src.exceptions import *
+from src.database import indexes
+from src.http_client import HttpClients
 import asyncio
-import httpx
 import json
 import base64
+import logging
 
 # from src.web_callback.payment.accept_payment import create_extend_recurrent_payment
 
 MAX_INT = 2 ** 31 - 1
 MAX_FLOAT = float(MAX_INT)
+MS_PER_DAY = 24 * 60 * 60 * 1000
+RATE_PERIODS = {
+    "месячный": 30,
+    "годовой": 365
+}
+
+
+class UserSnapshot:
+    def __init__(self, collection, user_id: int, keys: Optional[List[str]] = None):
+        self.collection = collection
+        self.user_id = user_id
+        self.keys = keys
+        self.data = {}
+
+        self._set = {}
+        self._inc = {}
+
+    async def load(self):
+        projection = {key: 1 for key in self.keys} if self.keys is not None else None
+        user_dict = await self.collection.find_one({"_id": self.user_id}, projection)
+
+        if user_dict is None:
+            raise ValueError(f"User {self.user_id} does not exist!")
+
+        self.data = user_dict
+        return self
+
+    def get(self, key: str, default: Any = None):
+        value = self.data
+        for part in key.split("."):
+            if not isinstance(value, dict) or part not in value:
+                return default
+            value = value[part]
+        return value
+
+    def _put(self, key: str, value: Any):
+        parts = key.split(".")
+        target = self.data
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+
+    def set(self, key: str, value: Any):
+        self._inc.pop(key, None)
+        self._set[key] = value
+        self._put(key, value)
+
+    def inc(self, key: str, value: int | float):
+        new_value = (self.get(key) or 0) + value
+        if key in self._set:
+            self._set[key] = new_value
+        else:
+            self._inc[key] = self._inc.get(key, 0) + value
+        self._put(key, new_value)
+
+    async def flush(self):
+        update = {}
+        if self._set:
+            update["$set"] = self._set
+        if self._inc:
+            update["$inc"] = self._inc
+        if not update:
+            return
+
+        await self.collection.update_one({"_id": self.user_id}, update)
+        self._set, self._inc = {}, {}
+
+    @property
+    def current_model(self) -> str:
+        return self.get("current_model")
+
+    @property
+    def current_dialog_id(self) -> Optional[str]:
+        return self.get("current_dialog_id")
+
+    @property
+    def rate(self) -> str:
+        return self.get("rate")
+
+    @property
+    def n_tokens(self) -> int:
+        return self.get("n_tokens", 0)
+
+    @property
+    def n_transcribed_seconds(self) -> float:
+        return self.get("n_transcribed_seconds", 0.0)
+
+    @property
+    def n_generate_seconds(self) -> float:
+        return self.get("n_generate_seconds", 0.0)
 
 
 class Database:
@@ -28,8 +123,55 @@ class Database:
         self.vs_collection = self.db["vs"]
         self.partner_collection = self.db["partner"]
         self.payments_collection = self.db["payments"]
+        self.broadcast_collection = self.db["broadcast"]
+        self.answer_cache_collection = self.db["answer_cache"]
+        self.files_collection = self.db["files"]
         # self.rec_payment_collection = self.db["recPayments"]
 
+        self.admin_ids = set()
+        self.admin_cache_ttl = Config.admin_cache_ttl
+        self._admin_cache_updated = None
+
+        self.rates = {}
+        self.rate_cache_ttl = Config.rate_cache_ttl
+        self._rate_cache_updated = None
+
+        self.renewal_queue = asyncio.Queue()
+        self._pending_renewals = set()
+
+    async def ensure_indexes(self):
+        await indexes.ensure_indexes(self.db)
+
+    async def explain_queries(self):
+        return await indexes.explain_queries(self.db)
+
+    async def load_admin_cache(self):
+        admin_ids = await self.admin_collection.distinct("_id")
+
+        self.admin_ids = set(admin_ids) | set(Config.admins_ids)
+        self._admin_cache_updated = time.monotonic()
+
+    def invalidate_admin_cache(self):
+        self._admin_cache_updated = None
+
+    def is_admin_cache_stale(self):
+        return self._admin_cache_updated is None or \
+            time.monotonic() - self._admin_cache_updated > self.admin_cache_ttl
+
+    async def load_rate_cache(self):
+        cursor = self.rate_collection.find({})
+        rates = await cursor.to_list(length=None)
+
+        self.rates = {rate["_id"]: rate for rate in rates}
+        self._rate_cache_updated = time.monotonic()
+
+    async def get_cached_rates(self):
+        if self._rate_cache_updated is None or \
+                time.monotonic() - self._rate_cache_updated > self.rate_cache_ttl:
+            await self.load_rate_cache()
+
+        return self.rates
+
     async def add_admins_from_config(self):
         admins = Config.admins_ids
         for admin in admins:
@@ -39,6 +181,8 @@ class Database:
 
             await self.admin_collection.insert_one(template)
 
+        self.invalidate_admin_cache()
+
     async def check_if_user_exists(self, user_id: int, raise_exception: bool = False):
         count = await self.user_collection.count_documents({"_id": user_id})
         if count > 0:
@@ -50,8 +194,10 @@ class Database:
                 return False
 
     async def check_if_admin_exists(self, admin_id: int, raise_exception: bool = False):
-        count = await self.admin_collection.count_documents({"_id": admin_id})
-        if count > 0:
+        if self.is_admin_cache_stale():
+            await self.load_admin_cache()
+
+        if admin_id in self.admin_ids:
             return True
         else:
             if raise_exception:
@@ -60,8 +206,7 @@ class Database:
                 return False
 
     async def check_if_rate_exists(self, name, raise_exception: bool = False):
-        count = await self.rate_collection.count_documents({"_id": name})
-        if count > 0:
+        if name in await self.get_cached_rates():
             return True
         else:
             if raise_exception:
@@ -136,7 +281,7 @@ class Database:
         rate = await self.get_user_attribute(user_id, "rate")
         await self.check_if_rate_exists(rate, raise_exception=True)
 
-        rate_dict = await self.rate_collection.find_one({"_id": rate})
+        rate_dict = (await self.get_cached_rates())[rate]
         type_ = rate_dict["type"]
 
         if (type_ == "месячный" and (datetime.now() - await self.get_user_attribute(user_id, "last_pay")).days <= 30) \
@@ -154,7 +299,7 @@ class Database:
         rate = await self.get_user_attribute(user_id, "rate")
         await self.check_if_rate_exists(rate, raise_exception=True)
 
-        rate_dict = await self.rate_collection.find_one({"_id": rate})
+        rate_dict = (await self.get_cached_rates())[rate]
         type_ = rate_dict["type"]
 
         if (type_ == "monthly" and (datetime.now() - await self.get_user_attribute(user_id, "last_pay")).days <= 30) \
@@ -177,7 +322,8 @@ class Database:
             "_id": reg_pay_num,
             "user_id": user_id,  # ?
             "rate_id": rate_id,
-            "amount": amount
+            "amount": amount,
+            "created_at": datetime.now()
         }
         if not await self.check_if_payments_exists(reg_pay_num):
             await self.payments_collection.insert_one(payment_dict)
@@ -217,6 +363,7 @@ class Database:
             "rate": "free",
             "last_pay": datetime.now(),
             "last_update": datetime.now(),
+            "rate_expires_at": None,
 
             # "n_recognition_images": 0,
             "n_transcribed_seconds": 0.0 if not is_admin else MAX_FLOAT,
@@ -256,51 +403,37 @@ class Database:
                            n_generate_seconds: float = 0.0,
                            n_used_tokens: float = 0.0):
 
-        current_spend = await self.get_user_attribute(user_id, "current_spend")
-        # last_reset = current_spend["last_reset"]
-
         now = datetime.now()
+        spent = {
+            "n_transcribed_seconds": n_transcribed_seconds,
+            "n_generate_seconds": n_generate_seconds,
+            "n_used_tokens": n_used_tokens
+        }
 
-        await self.set_user_attribute(user_id=user_id,
-                                      key="n_tokens",
-                                      value=await self.get_user_attribute(user_id, "n_tokens") - n_used_tokens)
-        await self.set_user_attribute(user_id=user_id,
-                                      key="n_transcribed_seconds",
-                                      value=await self.get_user_attribute(user_id,
-                                                                          "n_transcribed_seconds") - n_transcribed_seconds)
-        await self.set_user_attribute(user_id=user_id,
-                                      key="n_generate_seconds",
-                                      value=await self.get_user_attribute(user_id,
-                                                                          "n_generate_seconds") - n_generate_seconds)
+        spend_stage = {
+            "n_tokens": {"$subtract": ["$n_tokens", n_used_tokens]},
+            "n_transcribed_seconds": {"$subtract": ["$n_transcribed_seconds", n_transcribed_seconds]},
+            "n_generate_seconds": {"$subtract": ["$n_generate_seconds", n_generate_seconds]},
+        }
 
         def reset_if_necessary(interval_name, interval_duration):
-            if (now - current_spend[interval_name]["last_reset"]).days > interval_duration:
-                current_spend[interval_name]["n_transcribed_seconds"] = 0.0
-                current_spend[interval_name]["n_generate_seconds"] = 0.0
-                current_spend[interval_name]["n_used_tokens"] = 0.0
-                current_spend[interval_name]["last_reset"] = now
+            prefix = f"current_spend.{interval_name}"
+            # same as (now - last_reset).days > interval_duration, evaluated by mongo
+            expired = {"$gte": [{"$subtract": [now, f"${prefix}.last_reset"]},
+                                (interval_duration + 1) * MS_PER_DAY]}
+
+            for key, value in spent.items():
+                spend_stage[f"{prefix}.{key}"] = {"$add": [{"$cond": [expired, 0.0, f"${prefix}.{key}"]}, value]}
+            spend_stage[f"{prefix}.last_reset"] = {"$cond": [expired, now, f"${prefix}.last_reset"]}
 
         reset_if_necessary("day", 1)
         reset_if_necessary("week", 7)
         reset_if_necessary("month", 30)
 
-        current_spend["day"]["n_transcribed_seconds"] += n_transcribed_seconds
-        current_spend["day"]["n_generate_seconds"] += n_generate_seconds
-        current_spend["day"]["n_used_tokens"] += n_used_tokens
+        for key, value in spent.items():
+            spend_stage[f"current_spend.all.{key}"] = {"$add": [f"$current_spend.all.{key}", value]}
 
-        current_spend["week"]["n_transcribed_seconds"] += n_transcribed_seconds
-        current_spend["week"]["n_generate_seconds"] += n_generate_seconds
-        current_spend["week"]["n_used_tokens"] += n_used_tokens
-
-        current_spend["month"]["n_transcribed_seconds"] += n_transcribed_seconds
-        current_spend["month"]["n_generate_seconds"] += n_generate_seconds
-        current_spend["month"]["n_used_tokens"] += n_used_tokens
-
-        current_spend["all"]["n_transcribed_seconds"] += n_transcribed_seconds
-        current_spend["all"]["n_generate_seconds"] += n_generate_seconds
-        current_spend["all"]["n_used_tokens"] += n_used_tokens
-
-        await self.set_user_attribute(user_id, "current_spend", current_spend)
+        await self.user_collection.update_one({"_id": user_id}, [{"$set": spend_stage}])
 
     async def add_new_vs(self, vs_id):
         vs_dict = {
@@ -308,6 +441,7 @@ class Database:
         }
         if not await self.check_if_vs_exists(vs_id):
             await self.vs_collection.insert_one(vs_dict)
+            await self.clear_answer_cache()
 
     async def add_new_partner(self, partner_id):
         partner_dict = {
@@ -336,6 +470,7 @@ class Database:
 
         if not await self.check_if_rate_exists(name):
             await self.rate_collection.insert_one(rate)
+            self.rates[name] = rate
 
     async def add_new_promo(self,
                             promo_id: str,
@@ -356,7 +491,8 @@ class Database:
             "user_id": user_id,
             "start_time": datetime.now(),
             "model": await self.get_user_attribute(user_id, "current_model"),
-            "messages": []
+            "messages": [],
+            "thread_id": None
         }
 
         await self.dialog_collection.insert_one(dialog_dict)
@@ -377,11 +513,15 @@ class Database:
 
         return user_dict[key]
 
+    async def get_user_snapshot(self, user_id: int, keys: Optional[List[str]] = None) -> UserSnapshot:
+        snapshot = UserSnapshot(self.user_collection, user_id, keys)
+        return await snapshot.load()
+
     async def get_promo_attribute(self, promo_id, key: str):
         await self.check_if_promo_exists(promo_id, raise_exception=True)
         promo_dict = await self.promo_collection.find_one({"_id": promo_id})
 
-        rate_dict = await self.rate_collection.find_one({"_id": promo_dict["rate"]})
+        rate_dict = (await self.get_cached_rates()).get(promo_dict["rate"])
 
         if key not in promo_dict and key not in rate_dict:
             return None
@@ -392,7 +532,8 @@ class Database:
 
     async def get_rate_data(self, rate_name):
         await self.check_if_rate_exists(rate_name, raise_exception=True)
-        rate_data = await self.rate_collection.find_one({"_id": rate_name})
+        # callers get a copy, the cached dict is only changed through set_rate_attribute
+        rate_data = copy.deepcopy(self.rates[rate_name])
 
         return rate_data
 
@@ -409,9 +550,8 @@ class Database:
         return user_data
 
     async def get_all_rates(self):
-        cursor = self.rate_collection.find({})
-        rates = await cursor.to_list(length=None)
-        return rates
+        rates = await self.get_cached_rates()
+        return copy.deepcopy(list(rates.values()))
 
     async def get_all_vs(self):
         cursor = self.vs_collection.find({})
@@ -423,15 +563,99 @@ class Database:
         partners = await cursor.distinct('_id')
         return list(map(str, partners))
 
-    async def get_all_users_data(self):
-        cursor = self.user_collection.find({})
-        users = await cursor.to_list(length=None)
-        return users
+    async def iter_user_ids(self, after_id: Optional[int] = None, batch_size: int = Config.db_batch_size):
+        query = {} if after_id is None else {"_id": {"$gt": after_id}}
+        cursor = self.user_collection.find(query, {"_id": 1}).sort("_id", 1).batch_size(batch_size)
+        async for user in cursor:
+            yield user["_id"]
+
+    async def count_users(self):
+        return await self.user_collection.count_documents({})
+
+    async def get_usage_stats(self, top_n: int = 20):
+        spend_keys = ["n_used_tokens", "n_transcribed_seconds", "n_generate_seconds"]
+
+        totals = {
+            "_id": None,
+            "total_users": {"$sum": 1},
+            "free_users": {"$sum": {"$cond": [{"$eq": ["$rate", "free"]}, 1, 0]}}
+        }
+        for key in spend_keys:
+            totals[key] = {"$sum": f"$current_spend.month.{key}"}
+            totals[f"{key}_all"] = {"$sum": f"$current_spend.all.{key}"}
+
+        facets = {
+            "totals": [{"$group": totals}],
+            "rates": [{"$group": {"_id": "$rate", "count": {"$sum": 1}}},
+                      {"$sort": {"count": -1}}]
+        }
+        for key in spend_keys:
+            facets[f"top_{key}"] = [{"$sort": {f"current_spend.month.{key}": -1}},
+                                    {"$limit": top_n},
+                                    {"$project": {key: f"$current_spend.month.{key}"}}]
+
+        cursor = self.user_collection.aggregate([{"$facet": facets}], allowDiskUse=True)
+        stats = (await cursor.to_list(length=1))[0]
 
-    async def get_all_user_ids(self):
-        cursor = self.user_collection.find({})
-        user_ids = await cursor.distinct('_id')
-        return user_ids
+        if stats["totals"]:
+            stats["totals"] = stats["totals"][0]
+        else:
+            stats["totals"] = {key: 0 for key in totals if key != "_id"}
+
+        return stats
+
+    async def add_new_campaign(self,
+                               admin_id: int,
+                               from_chat_id: int,
+                               message_id: int,
+                               status_chat_id: int,
+                               status_message_id: int):
+        campaign_id = str(uuid.uuid4())
+        campaign_dict = {
+            "_id": campaign_id,
+            "admin_id": admin_id,
+            "from_chat_id": from_chat_id,
+            "message_id": message_id,
+            "status_chat_id": status_chat_id,
+            "status_message_id": status_message_id,
+            "state": "running",
+            "cursor": None,
+            "batch_sent": [],
+            "n_total": await self.count_users(),
+            "n_delivered": 0,
+            "n_blocked": 0,
+            "n_failed": 0,
+            "created_at": datetime.now(),
+            "finished_at": None
+        }
+
+        await self.broadcast_collection.insert_one(campaign_dict)
+        return campaign_id
+
+    async def get_campaign(self, campaign_id: str):
+        return await self.broadcast_collection.find_one({"_id": campaign_id})
+
+    async def get_running_campaigns(self):
+        cursor = self.broadcast_collection.find({"state": "running"})
+        return await cursor.to_list(length=None)
+
+    async def mark_campaign_sent(self, campaign_id: str, chat_id: int, result: str):
+        # ids sent since the last cursor; a restart mid-batch skips them instead of sending twice
+        await self.broadcast_collection.update_one({"_id": campaign_id}, {
+            "$push": {"batch_sent": chat_id},
+            "$inc": {f"n_{result}": 1}
+        })
+
+    async def update_campaign_progress(self, campaign_id: str, cursor_id: int):
+        await self.broadcast_collection.update_one({"_id": campaign_id}, {
+            "$set": {"cursor": cursor_id, "batch_sent": []}
+        })
+
+    async def set_campaign_state(self, campaign_id: str, state: str):
+        await self.broadcast_collection.update_one({"_id": campaign_id}, {"$set": {
+            "state": state,
+            "finished_at": datetime.now() if state != "running" else None
+        }})
 
     async def get_payments_by_reg(self, reg_pay_id):
         payment_data = await self.payments_collection.find_one({"_id": reg_pay_id})
@@ -441,6 +665,7 @@ class Database:
     async def delete_rate(self, rate_name):
         await self.check_if_rate_exists(rate_name, raise_exception=True)
         await self.rate_collection.delete_one({"_id": rate_name})
+        self.rates.pop(rate_name, None)
 
     async def delete_payment(self, p_id):
         await self.check_if_payments_exists(p_id, raise_exception=True)
@@ -453,7 +678,7 @@ class Database:
     async def get_rate_attribute(self, rate_name, key: str):
         await self.check_if_rate_exists(rate_name, raise_exception=True)
 
-        rate_dict = await self.rate_collection.find_one({"_id": rate_name})
+        rate_dict = self.rates[rate_name]
 
         if key not in rate_dict:
             return None
@@ -466,6 +691,7 @@ class Database:
     async def set_rate_attribute(self, rate_name, key: str, value: Any):
         await self.check_if_rate_exists(rate_name, raise_exception=True)
         await self.rate_collection.update_one({"_id": rate_name}, {"$set": {key: value}})
+        self.rates[rate_name][key] = value
 
     async def update_n_used_tokens(self, user_id: int, model: str, n_input_tokens: int, n_output_tokens: int):
         await self.check_if_user_exists(user_id, raise_exception=True)
@@ -491,8 +717,85 @@ class Database:
         dialog_dict = await self.dialog_collection.find_one({"_id": dialog_id, "user_id": user_id})
         return dialog_dict["messages"]
 
+    async def get_recent_turns(self, user_id: int, n: int, dialog_id: Optional[str] = None):
+        if dialog_id is None:
+            dialog_id = await self.get_user_attribute(user_id, "current_dialog_id")
+
+        dialog_dict = await self.dialog_collection.find_one({"_id": dialog_id, "user_id": user_id},
+                                                            {"messages": {"$slice": -n}})
+        if dialog_dict is None:
+            # expired by the dialog ttl index, append_dialog_turn recreates it
+            return []
+
+        return dialog_dict["messages"]
+
+    async def append_dialog_turn(self, user_id: int, dialog_message: dict,
+                                 dialog_id: Optional[str] = None,
+                                 max_messages: int = Config.max_dialog_messages):
+        if dialog_id is None:
+            dialog_id = await self.get_user_attribute(user_id, "current_dialog_id")
+        if dialog_id is None:
+            # a user who never ran /start has no dialog yet, an upsert would store it under _id null
+            dialog_id = await self.start_new_dialog(user_id)
+
+        await self.dialog_collection.update_one(
+            {"_id": dialog_id, "user_id": user_id},
+            {"$push": {"messages": {"$each": [dialog_message], "$slice": -max_messages}},
+             "$setOnInsert": {"start_time": datetime.now()}},
+            upsert=True
+        )
+
+    async def get_dialog_thread(self, user_id: int, dialog_id: str):
+        dialog_dict = await self.dialog_collection.find_one({"_id": dialog_id, "user_id": user_id},
+                                                            {"thread_id": 1, "thread_vs_ids": 1})
+        if dialog_dict is None:
+            return None, []
+
+        return dialog_dict.get("thread_id"), dialog_dict.get("thread_vs_ids", [])
+
+    async def set_dialog_thread(self, user_id: int, dialog_id: str,
+                                thread_id: Optional[str], vs_ids: Optional[list] = None):
+        if dialog_id is None:
+            return
+
+        await self.dialog_collection.update_one(
+            {"_id": dialog_id, "user_id": user_id},
+            {"$set": {"thread_id": thread_id, "thread_vs_ids": vs_ids or []},
+             "$setOnInsert": {"start_time": datetime.now(), "messages": []}},
+            upsert=True
+        )
+
+    async def pop_last_dialog_turn(self, user_id: int, dialog_id: Optional[str] = None):
+        if dialog_id is None:
+            dialog_id = await self.get_user_attribute(user_id, "current_dialog_id")
+
+        last_turns = await self.get_recent_turns(user_id, 1, dialog_id=dialog_id)
+        if not last_turns:
+            return None
+
+        # the thread still holds the popped turn, so the next turn rebuilds it from history
+        await self.dialog_collection.update_one(
+            {"_id": dialog_id, "user_id": user_id},
+            {"$pop": {"messages": 1}, "$set": {"thread_id": None}}
+        )
+        return last_turns[0]
+
+    async def set_last_feedback(self, user_id: int, dialog_id: Optional[str] = None, feed: bool = None):
+        if dialog_id is None:
+            dialog_id = await self.get_user_attribute(user_id, "current_dialog_id")
+
+        # rewrites only the last element on the server side
+        last_index = {"$subtract": [{"$size": "$messages"}, 1]}
+        await self.dialog_collection.update_one(
+            {"_id": dialog_id, "user_id": user_id, "messages.0": {"$exists": True}},
+            [{"$set": {"messages": {"$concatArrays": [
+                {"$slice": ["$messages", last_index]},
+                [{"$mergeObjects": [{"$arrayElemAt": ["$messages", -1]}, {"feed": feed}]}]
+            ]}}}]
+        )
+
     async def get_dialog_last(self, user_id: int, dialog_id: Optional[str] = None):
-        dialog_messages = await self.get_dialog_messages(user_id, dialog_id)
+        dialog_messages = await self.get_recent_turns(user_id, 1, dialog_id)
 
         if dialog_messages != []:
             return dialog_messages[-1]["date"]
@@ -500,12 +803,9 @@ class Database:
             return datetime.now()
 
     async def set_feedback(self, user_id, dialog_id: str = None, feed: bool = None):
-        dialoges = await self.get_dialog_messages(user_id, dialog_id)
-        dialoges[-1]["feed"] = feed
-
-        await self.set_dialog_messages(user_id=user_id,
-                                       dialog_messages=dialoges,
-                                       dialog_id=dialog_id)
+        await self.set_last_feedback(user_id=user_id,
+                                     dialog_id=dialog_id,
+                                     feed=feed)
 
     async def set_dialog_messages(self, user_id: int, dialog_messages: list, dialog_id: Optional[str] = None):
         await self.check_if_user_exists(user_id, raise_exception=True)
@@ -515,7 +815,51 @@ class Database:
 
         await self.dialog_collection.update_one(
             {"_id": dialog_id, "user_id": user_id},
-            {"$set": {"messages": dialog_messages}}
+            {"$set": {"messages": dialog_messages, "thread_id": None}}
+        )
+
+    async def get_cached_answer(self, key: str):
+        return await self.answer_cache_collection.find_one_and_update(
+            {"_id": key},
+            {"$set": {"last_hit": datetime.now()}, "$inc": {"n_hits": 1}}
+        )
+
+    async def set_cached_answer(self, key: str, scope: str, prompt: str, answer: str,
+                                max_entries: int = Config.answer_cache_max_entries):
+        now = datetime.now()
+        await self.answer_cache_collection.update_one(
+            {"_id": key},
+            {"$set": {"scope": scope, "prompt": prompt, "answer": answer,
+                      "created_at": now, "last_hit": now},
+             "$setOnInsert": {"n_hits": 0}},
+            upsert=True
+        )
+
+        n_entries = await self.answer_cache_collection.estimated_document_count()
+        if n_entries > max_entries:
+            # least recently hit entries go first, stale ones are removed by the ttl index
+            cursor = self.answer_cache_collection.find({}, {"_id": 1}).sort("last_hit", 1).limit(n_entries - max_entries)
+            evicted = [entry["_id"] async for entry in cursor]
+            await self.answer_cache_collection.delete_many({"_id": {"$in": evicted}})
+
+    async def clear_answer_cache(self):
+        await self.answer_cache_collection.delete_many({})
+
+    async def get_file_names(self, file_ids: List[str]):
+        cursor = self.files_collection.find({"_id": {"$in": file_ids}}, {"filename": 1})
+        return {file_["_id"]: file_["filename"] async for file_ in cursor}
+
+    async def add_file_names(self, names: dict):
+        if not names:
+            return
+
+        await self.files_collection.bulk_write(
+            [UpdateOne({"_id": file_id},
+                       {"$set": {"filename": filename},
+                        "$setOnInsert": {"created_at": datetime.now()}},
+                       upsert=True)
+             for file_id, filename in names.items()],
+            ordered=False
         )
 
     async def use_promo(self, promo_id, user_id):
@@ -526,7 +870,7 @@ class Database:
 
         await self.check_if_rate_exists(promo_dict["rate"], raise_exception=True)
 
-        rate_dict = await self.rate_collection.find_one({"_id": promo_dict["rate"]})
+        rate_dict = (await self.get_cached_rates()).get(promo_dict["rate"])
 
         rate_models, user_models = rate_dict["models"], await self.get_user_attribute(user_id, "models")
         new_models = list(set(rate_models) | set(user_models))
@@ -548,7 +892,7 @@ class Database:
         await self.check_if_user_exists(user_id, raise_exception=True)
         await self.check_if_rate_exists(rate_name, raise_exception=True)
 
-        rate_dict = await self.rate_collection.find_one({"_id": rate_name})
+        rate_dict = self.rates[rate_name]
 
         # rate_models, user_models = rate_dict["models"], await self.get_user_attribute(user_id, "models")
         # new_models = list(set(rate_models) | set(user_models))
@@ -573,6 +917,7 @@ class Database:
         }})
 
         await self.use_rate(rate_name=rate_name, user_id=user_id)
+        await self.update_rate_expiration(user_id)
 
     async def accept_payment(self, reg_pay_id):
         await self.check_if_payments_exists(reg_pay_id, raise_exception=True)
@@ -584,7 +929,7 @@ class Database:
         if await self.get_rate_attribute(rate_name=payment_data["rate_id"], key="price") <= \
                 payment_data["amount"] * 100:
             await self.set_user_attribute(user_id, "last_pay", datetime.now())
-            await self.update_user(user_id)
+            await self.renew_user(user_id)
             await self.delete_payment(p_id=reg_pay_id)
             return True
         return False
@@ -595,38 +940,135 @@ class Database:
 
         await self.set_user_attribute(user_id, "last_pay", datetime.now())
         await self.set_user_attribute(user_id, "rate", rate_name)
-        await self.update_user(user_id, from_pay=True)
+        await self.renew_user(user_id, from_pay=True)
         await self.delete_payment_user(user_id)
 
     async def update_user(self, user_id, from_pay=False):
+        if from_pay:
+            await self.renew_user(user_id, from_pay=True)
+            return
+
+        user_dict = await self.user_collection.find_one_and_update(
+            {"_id": user_id},
+            {"$set": {"last_interaction": datetime.now()}},
+            projection={"rate_expires_at": 1}
+        )
+        if user_dict is None:
+            raise ValueError(f"User {user_id} does not exist!")
+
+        if "rate_expires_at" not in user_dict:
+            self.schedule_renewal(user_id)
+        elif user_dict["rate_expires_at"] is not None and user_dict["rate_expires_at"] <= datetime.now():
+            self.schedule_renewal(user_id)
+
+    async def renew_user(self, user_id, from_pay=False):
         await self.check_if_user_exists(user_id, raise_exception=True)
-        await self.set_user_attribute(user_id, "last_interaction", datetime.now())
         rate_name = await self.get_user_attribute(user_id, "rate")
+        retry_after = None
 
         if rate_name == "free":
+            await self.update_rate_expiration(user_id)
+            return
+
+        rate_dict = (await self.get_cached_rates()).get(rate_name)
+        if rate_dict is None or rate_dict["type"] not in RATE_PERIODS:
+            # nothing to renew against, retrying would only re-queue the user on every sweep
+            reason = "is deleted" if rate_dict is None else f"has unknown type {rate_dict['type']!r}"
+            logging.error(f"User {user_id} moved to free: rate {rate_name!r} {reason}")
+            await self._downgrade_to_free(user_id)
+            await self.update_rate_expiration(user_id)
             return
 
-        # date_data = await self.get_rate_data(rate_name)
-        # rate_type = await
         if from_pay:
             await self.use_rate(rate_name, user_id)
             await self.set_user_attribute(user_id, "last_update", datetime.now())
 
         if await self.check_payment(user_id):
+            await self.set_user_attribute(user_id, "renewal_attempts", 0)
             n_days = (datetime.now() - await self.get_user_attribute(user_id, "last_update")).days
             if n_days >= 30:
                 await self.use_rate(rate_name, user_id)
                 await self.set_user_attribute(user_id, "last_update", datetime.now())
         else:
-            if await self.get_user_attribute(user_id, "userToken") is not None:
+            n_attempts = await self.get_user_attribute(user_id, "renewal_attempts") or 0
+            has_token = await self.get_user_attribute(user_id, "userToken") is not None
+
+            if has_token and n_attempts < Config.renewal_max_attempts:
+                retry_after = Config.renewal_retry_interval
+                await self.user_collection.update_one({"_id": user_id}, {"$inc": {"renewal_attempts": 1},
+                                                                         "$set": {"last_renewal_attempt": datetime.now()}})
                 try:
                     await self.create_extend_recurrent_payment(user_id, rate_name)
-                except:
-                    pass
+                except Exception as e:
+                    logging.warning(f"Recurrent payment for {user_id} not created "
+                                    f"(attempt {n_attempts + 1}/{Config.renewal_max_attempts}): {e}")
             else:
-                await self.set_user_attribute(user_id, "rate", "free")
-                await self.use_rate("free", user_id)
-                await self.set_user_attribute(user_id, "last_update", datetime.now())
+                if has_token:
+                    logging.warning(f"User {user_id} moved to free after {n_attempts} failed renewals")
+                await self._downgrade_to_free(user_id)
+
+        await self.update_rate_expiration(user_id, retry_after=retry_after)
+
+    async def _downgrade_to_free(self, user_id):
+        await self.set_user_attribute(user_id, "renewal_attempts", 0)
+        await self.set_user_attribute(user_id, "rate", "free")
+        await self.use_rate("free", user_id)
+        await self.set_user_attribute(user_id, "last_update", datetime.now())
+
+    async def update_rate_expiration(self, user_id, retry_after: Optional[int] = None):
+        user_dict = await self.user_collection.find_one({"_id": user_id},
+                                                        {"rate": 1, "last_pay": 1, "last_update": 1})
+        rate_name = user_dict["rate"]
+
+        if rate_name == "free":
+            rate_expires_at = None
+        else:
+            rate_dict = (await self.get_cached_rates()).get(rate_name)
+            rate_type = rate_dict["type"] if rate_dict is not None else None
+            refill_at = user_dict["last_update"] + timedelta(days=30)
+
+            if rate_type in RATE_PERIODS:
+                # check_payment accepts (now - last_pay).days <= n_days
+                paid_until = user_dict["last_pay"] + timedelta(days=RATE_PERIODS[rate_type] + 1)
+                rate_expires_at = min(paid_until, refill_at)
+            else:
+                # an unknown period must not expire the user on the spot
+                logging.error(f"Unknown type {rate_type!r} of rate {rate_name!r} for user {user_id}")
+                rate_expires_at = refill_at
+
+            if retry_after is not None:
+                rate_expires_at = max(rate_expires_at, datetime.now() + timedelta(seconds=retry_after))
+
+        await self.user_collection.update_one({"_id": user_id}, {"$set": {"rate_expires_at": rate_expires_at}})
+
+    def schedule_renewal(self, user_id):
+        if user_id in self._pending_renewals:
+            return
+
+        self._pending_renewals.add(user_id)
+        self.renewal_queue.put_nowait(user_id)
+
+    async def run_renewal_worker(self):
+        while True:
+            user_id = await self.renewal_queue.get()
+            try:
+                await self.renew_user(user_id)
+            except Exception as e:
+                logging.exception(e)
+            finally:
+                self._pending_renewals.discard(user_id)
+                self.renewal_queue.task_done()
+
+    async def run_renewal_sweeper(self, interval: int = Config.renewal_sweep_interval):
+        while True:
+            try:
+                cursor = self.user_collection.find({"rate_expires_at": {"$lte": datetime.now()}}, {"_id": 1})
+                async for user_dict in cursor:
+                    self.schedule_renewal(user_dict["_id"])
+            except Exception as e:
+                logging.exception(e)
+
+            await asyncio.sleep(interval)
 
     async def accept_extend_rec_pay(self, user_id: int):
         await self.check_if_user_exists(user_id, raise_exception=True)
@@ -701,19 +1143,16 @@ class Database:
             ]
         })
 
-        async with httpx.AsyncClient() as client:
+        reg_response = await HttpClients.request(method="POST",
+                                                 url=url,
+                                                 headers=headers,
+                                                 data=payload)
 
-            reg_response = await client.request(method="POST",
-                                                url=url,
-                                                headers=headers,
-                                                data=payload,
-                                                timeout=None)
-
-            if reg_response.status_code == 200:
-                data_rec_pay = reg_response.json()
-                return data_rec_pay
-            else:
-                raise ConfirmPaymentError
+        if reg_response.status_code == 200:
+            data_rec_pay = reg_response.json()
+            return data_rec_pay
+        else:
+            raise ConfirmPaymentError
 
     async def processing_payments(self,
                                   data_rec_pay: dict,
@@ -778,19 +1217,16 @@ class Database:
             'middleName': middlename,
         })
 
-        async with httpx.AsyncClient() as client:
-
-            reg_response = await client.request(method="POST",
-                                                url=url,
-                                                headers=headers,
-                                                data=payload,
-                                                timeout=None)
+        reg_response = await HttpClients.request(method="POST",
+                                                 url=url,
+                                                 headers=headers,
+                                                 data=payload)
 
-            if reg_response.status_code == 200:
-                return reg_response.json()
+        if reg_response.status_code == 200:
+            return reg_response.json()
 
-            else:
-                raise RegistrationError
+        else:
+            raise RegistrationError
 
     async def get_active_user_cards(self,
                                     user_token: str,
@@ -805,21 +1241,18 @@ class Database:
             "userToken": user_token,
         })
 
-        async with httpx.AsyncClient() as client:
-
-            reg_response = await client.request(method="POST",
-                                                url=url,
-                                                headers=headers,
-                                                data=payload,
-                                                timeout=None)
+        reg_response = await HttpClients.request(method="POST",
+                                                 url=url,
+                                                 headers=headers,
+                                                 data=payload)
 
-            if reg_response.status_code == 200:
-                cards_data = reg_response.json()
-                active_cards_tokens = [card["cardToken"] for card in cards_data["cards"] if card["state"] == "active"]
-                return active_cards_tokens
+        if reg_response.status_code == 200:
+            cards_data = reg_response.json()
+            active_cards_tokens = [card["cardToken"] for card in cards_data["cards"] if card["state"] == "active"]
+            return active_cards_tokens
 
-            else:
-                raise RecurrentPaymentCheckError
+        else:
+            raise RecurrentPaymentCheckError
 
     async def get_status_recurrent_payment(self,
                                            url: str = "https://demo-api2.ckassa.ru/api-shop/rs/shop/check/payment/state",
@@ -837,19 +1270,16 @@ class Database:
             "regPayNum": reg_pay_num,
         })
 
-        async with httpx.AsyncClient() as client:
-
-            reg_response = await client.request(method="POST",
-                                                url=url,
-                                                headers=headers,
-                                                data=payload,
-                                                timeout=None)
+        reg_response = await HttpClients.request(method="POST",
+                                                 url=url,
+                                                 headers=headers,
+                                                 data=payload)
 
-            if reg_response.status_code == 200:
-                return reg_response.json()
+        if reg_response.status_code == 200:
+            return reg_response.json()
 
-            else:
-                raise RecurrentPaymentCheckError
+        else:
+            raise RecurrentPaymentCheckError
 
     async def confirm_payment(self,
                               url: str = "https://demo-api2.ckassa.ru/api-shop/provision-services/confirm",
@@ -868,19 +1298,16 @@ class Database:
             "orderId": order_id
         })
 
-        async with httpx.AsyncClient() as client:
+        reg_response = await HttpClients.request(method="POST",
+                                                 url=url,
+                                                 headers=headers,
+                                                 data=payload)
 
-            reg_response = await client.request(method="POST",
-                                                url=url,
-                                                headers=headers,
-                                                data=payload,
-                                                timeout=None)
+        if reg_response.status_code == 200:
+            return reg_response.json()
 
-            if reg_response.status_code == 200:
-                return reg_response.json()
-
-            else:
-                raise ConfirmPaymentError
+        else:
+            raise ConfirmPaymentError
 
 
 DataBase = Database()
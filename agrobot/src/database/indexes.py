@@ -0,0 +1,103 @@
+from pymongo import ASCENDING, IndexModel
+from datetime import datetime
+import asyncio
+
+from src.config import Config
+
+
+INDEXES = {
+    "user": [
+        IndexModel([("rate", ASCENDING)], name="rate"),
+        IndexModel([("rate_expires_at", ASCENDING)], name="rate_expires_at"),
+    ],
+    "dialog": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("start_time", ASCENDING)], name="start_time_ttl",
+                   expireAfterSeconds=Config.dialog_ttl),
+    ],
+    "payments": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl",
+                   expireAfterSeconds=Config.payment_ttl),
+    ],
+    "promo": [
+        IndexModel([("rate", ASCENDING)], name="rate"),
+    ],
+    "broadcast": [
+        IndexModel([("state", ASCENDING)], name="state"),
+    ],
+    "answer_cache": [
+        IndexModel([("last_hit", ASCENDING)], name="last_hit"),
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl",
+                   expireAfterSeconds=Config.answer_cache_ttl),
+    ],
+}
+
+# (collection, filter, full scan is expected)
+QUERY_SHAPES = [
+    ("user", {"_id": 0}, False),
+    ("user", {"rate_expires_at": {"$lte": datetime.now()}}, False),
+    ("user", {"rate": "free"}, False),
+    ("user", {}, True),
+    ("user", {"_id": {"$gt": 0}}, False),
+    ("dialog", {"_id": "", "user_id": 0}, False),
+    ("dialog", {"user_id": 0}, False),
+    ("payments", {"_id": 0}, False),
+    ("payments", {"user_id": 0}, False),
+    ("promo", {"_id": ""}, False),
+    ("rate", {"_id": ""}, False),
+    ("rate", {}, True),
+    ("admin", {}, True),
+    ("vs", {"_id": ""}, False),
+    ("vs", {}, True),
+    ("partner", {"_id": ""}, False),
+    ("partner", {}, True),
+    ("broadcast", {"_id": ""}, False),
+    ("broadcast", {"state": "running"}, False),
+    ("answer_cache", {"_id": ""}, False),
+    ("files", {"_id": {"$in": [""]}}, False),
+]
+
+
+async def ensure_indexes(db):
+    for collection_name, indexes in INDEXES.items():
+        await db[collection_name].create_indexes(indexes)
+
+
+def _plan_stages(plan: dict):
+    stages = [plan.get("stage")]
+
+    if "inputStage" in plan:
+        stages += _plan_stages(plan["inputStage"])
+    for input_stage in plan.get("inputStages", []):
+        stages += _plan_stages(input_stage)
+
+    return stages
+
+
+async def explain_queries(db):
+    report = []
+    for collection_name, query, allow_collscan in QUERY_SHAPES:
+        explain = await db[collection_name].find(query).explain()
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+
+        report.append({
+            "collection": collection_name,
+            "query": query,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages and not allow_collscan
+        })
+
+    return report
+
+
+if __name__ == "__main__":
+    from src.database import DataBase
+
+    async def _audit():
+        await DataBase.ensure_indexes()
+        for row in await DataBase.explain_queries():
+            flag = "COLLSCAN" if row["collscan"] else "ok"
+            print(f"{flag:<9} {row['collection']:<9} {row['query']} -> {' > '.join(map(str, row['stages']))}")
+
+    asyncio.run(_audit())
@@ -13,8 +13,9 @@ from src.nn import KnowledgeLoader, OpenAIHelper
 from src.utils import ADMIN_HELP_MESSAGE, HELP_GROUP_CHAT_MESSAGE, \
     ADMIN_MENU_TEXT, ADMIN_RATE_TEXT, \
     get_rate_data, ADMIN_ADD_KNOWLEDGE_TEXT, \
-    Stats, register_admin_in_db_as_user, \
-    show_rates_admin, is_previous_message_not_answered_yet
+    Stats, StreamRenderer, register_admin_in_db_as_user, \
+    show_rates_admin, is_previous_message_not_answered_yet, \
+    Broadcast
 from src.utils.general import extract_docx_text, extract_pdf_text, \
     extract_pptx_text, extract_xlsx_text
 
@@ -117,27 +118,18 @@ async def notify_message_handler(message: Message | CallbackQuery, state: FSMCon
                                      parse_mode="HTML")
         return
 
-    await message.answer('⏳ Подождите... идёт рассылка.')
-
     admin_id = message.from_user.id
 
-    user_ids = await db.get_all_user_ids()
-
-    async def _send_message(_user_id):
-        try:
-            await message.send_copy(chat_id=_user_id)
-
-        except Exception as e:
-            await message.answer(f"❌ Произошла ошибка: <i>{e}</i> при отправлении пользователю <i>{_user_id}</i>",
-                                 parse_mode="HTML")
-
-    async def send_task():
-        await asyncio.gather(*[_send_message(int(user_id)) for user_id in user_ids])
+    status_message = await message.answer('⏳ Подождите... идёт рассылка.')
+    campaign_id = await Broadcast.create_campaign(admin_id=admin_id,
+                                                  from_chat_id=message.chat.id,
+                                                  message_id=message.message_id,
+                                                  status_chat_id=status_message.chat.id,
+                                                  status_message_id=status_message.message_id)
+    await state.clear()
 
     async with admin_semaphores[admin_id]:
-        task = asyncio.create_task(
-            send_task()
-        )
+        task = Broadcast.start(message.bot, campaign_id)
 
         admin_tasks[admin_id] = task
         try:
@@ -146,13 +138,11 @@ async def notify_message_handler(message: Message | CallbackQuery, state: FSMCon
             await message.answer("✅ Процесс завершен",
                                  parse_mode="HTML")
         else:
-            pass
+            await message.answer("✅ Рассылка успешно завершена",
+                                 parse_mode="HTML")
         finally:
             if admin_id in admin_tasks:
                 del admin_tasks[admin_id]
-            await message.answer("✅ Рассылка успешно завершена",
-                                 parse_mode="HTML")
-            await state.clear()
 
 
 @admin.message(AdminCheck(), Command("menu"))
@@ -854,7 +844,7 @@ async def get_admin_stats(message: Message | CallbackQuery):
     await db.set_user_attribute(admin_id, "last_interaction", datetime.now())
 
     stats_data = await Stats(admin_id)
-    stats_text = stats_data["text_stats"][0]
+    stats_text = stats_data["text_stats"]
     data_point = stats_data["data"]
 
     if isinstance(message, Message):
@@ -897,10 +887,11 @@ async def cancel_handle_admin(message: Message):
 
     await db.set_user_attribute(admin_id, "last_interaction", datetime.now())
 
+    is_broadcast_cancelled = Broadcast.cancel(admin_id)
     if admin_id in admin_tasks.keys():
         task = admin_tasks[admin_id]
         task.cancel()
-    else:
+    elif not is_broadcast_cancelled:
         await message.answer(text="<i>Нечего останавливать...</i>",
                              parse_mode="HTML")
 
@@ -912,16 +903,13 @@ async def retry_handle_admin(message: Message):
 
     await db.set_user_attribute(admin_id, "last_interaction", datetime.now())
 
-    dialog_messages = await db.get_dialog_messages(admin_id, dialog_id=None)
+    last_dialog_message = await db.pop_last_dialog_turn(admin_id, dialog_id=None)
 
-    if len(dialog_messages) == 0:
+    if last_dialog_message is None:
         await message.answer(text="Нет сообщений для повтора 🤷‍♂️",
                              parse_mode="HTML")
         return
 
-    last_dialog_message = dialog_messages.pop()
-    await db.set_dialog_messages(admin_id, dialog_messages, dialog_id=None)
-
     message.text = last_dialog_message["user"]
     await _message_handle_admin(message=message,
                                 use_new_dialog_timeout=False)
@@ -1076,20 +1064,28 @@ async def _message_handle_admin(message: Message,
                                 video: io.BytesIO = None,
                                 context: str = None,
                                 use_new_dialog_timeout: bool = True):
+    renderer = None
+    admin_snapshot = None
     try:
 
         admin_id = message.from_user.id
-        current_model = await db.get_user_attribute(admin_id, "current_model")
+        admin_snapshot = await db.get_user_snapshot(admin_id, keys=["current_model",
+                                                                    "current_dialog_id"])
+        current_model = admin_snapshot.current_model
+        dialog_id = admin_snapshot.current_dialog_id
+        dialog_messages = await db.get_recent_turns(admin_id, Config.max_dialog_messages, dialog_id=dialog_id)
+
         if use_new_dialog_timeout:
-            last_message = await db.get_dialog_last(user_id=admin_id)
+            last_message = dialog_messages[-1]["date"] if dialog_messages else datetime.now()
             if (datetime.now() - last_message).seconds > \
-                    Config.new_dialog_timeout and len(await db.get_dialog_messages(user_id=admin_id)) > 0:
-                await db.start_new_dialog(admin_id)
+                    Config.new_dialog_timeout and len(dialog_messages) > 0:
+                dialog_id = await db.start_new_dialog(admin_id)
+                dialog_messages = []
 
                 await message.answer(f"Начало нового диалога из-за тайм-аута ✅",
                                      parse_mode="HTML")
 
-        await db.set_user_attribute(admin_id, "last_interaction", datetime.now())
+        admin_snapshot.set("last_interaction", datetime.now())
 
         message_text = message.text
         if message_text == "" and image is None and video is None:
@@ -1097,8 +1093,6 @@ async def _message_handle_admin(message: Message,
                                  parse_mode="HTML")
             return
 
-        dialog_messages = await db.get_dialog_messages(admin_id, dialog_id=None)
-
         if context is not None:
             message_text = f"Контекст: {context}\nПользователь: {message_text}"
 
@@ -1106,22 +1100,33 @@ async def _message_handle_admin(message: Message,
                                                    parse_mode="HTML")
         await message.bot.send_chat_action(chat_id=admin_id,
                                            action="typing")
+        renderer = StreamRenderer(bot=message.bot,
+                                  chat_id=admin_id,
+                                  message_id=placeholder_message.message_id)
 
         answer, (n_input_tokens,
                  n_output_tokens), n_first_dialog_messages_removed, is_voice = await openai_helper.send_message_assistant(
             message=message_text,
             dialog_messages=dialog_messages,
             image_buffer=image,
-            video_buffer=video
+            video_buffer=video,
+            on_delta=renderer.feed,
+            user_id=admin_id,
+            dialog_id=dialog_id,
+            model=current_model
         )
 
         await asyncio.sleep(0.01)
     except asyncio.CancelledError:
+        if renderer is not None:
+            await renderer.abort()
         # await db.update_n_used_tokens(admin_id, current_model, n_input_tokens, n_output_tokens)
         raise
 
     except Exception as e:
         logging.exception(e)
+        if renderer is not None:
+            await renderer.delete()
         await message.answer("❌  Хьюстон, у нас проблемы!\nЧто-то пошло не так при "
                              "обработке запроса!\nПопробуйте снова или обратитесь в тех. поддержку:",
                              reply_markup=get_help_keyboard(),
@@ -1130,8 +1135,7 @@ async def _message_handle_admin(message: Message,
 
         if is_voice:
 
-            await message.bot.delete_message(chat_id=admin_id,
-                                             message_id=placeholder_message.message_id)
+            await renderer.delete()
 
             audio_path, gen_second = await openai_helper.generate_speech(text=answer)
 
@@ -1139,44 +1143,37 @@ async def _message_handle_admin(message: Message,
                 chat_id=admin_id,
                 voice=audio_path,
                 reply_markup=get_feed_kb(user_id=admin_id,
-                                         dialog_id=await db.get_user_attribute(user_id=admin_id,
-                                                                               key="current_dialog_id")))
+                                         dialog_id=dialog_id))
             await db.update_spend(user_id=admin_id,
                                   n_generate_seconds=gen_second)
 
         else:
 
-            await message.bot.edit_message_text(
-                text=answer,
-                chat_id=admin_id,
-                message_id=placeholder_message.message_id,
-                parse_mode="HTML",
-                reply_markup=get_feed_kb(user_id=admin_id,
-                                         dialog_id=await db.get_user_attribute(user_id=admin_id,
-                                                                               key="current_dialog_id")))
+            await renderer.finish(answer,
+                                  reply_markup=get_feed_kb(user_id=admin_id,
+                                                           dialog_id=dialog_id))
 
         new_dialog_message = {"user": [{"type": "text",
                                         "text": message_text}],
                               "bot": answer,
                               "date": datetime.now(),
                               "feed": None}
-        dialog_messages = await db.get_dialog_messages(admin_id, dialog_id=None)
-
-        dialog_messages = dialog_messages[n_first_dialog_messages_removed:] + [new_dialog_message]
+        if n_first_dialog_messages_removed > 0:
+            max_messages = len(dialog_messages) - n_first_dialog_messages_removed + 1
+        else:
+            max_messages = Config.max_dialog_messages
 
-        await db.set_dialog_messages(
+        await db.append_dialog_turn(
             user_id=admin_id,
-            dialog_messages=dialog_messages,
-            dialog_id=None
+            dialog_message=new_dialog_message,
+            dialog_id=dialog_id,
+            max_messages=max_messages
         )
         await db.update_spend(user_id=admin_id,
                               n_used_tokens=n_input_tokens + n_output_tokens)
 
-        old_spend_token = await db.get_user_attribute(admin_id, "n_used_tokens")
-        old_spend_token["n_input_tokens"] += n_input_tokens
-        old_spend_token["n_output_tokens"] += n_output_tokens
-
-        await db.set_user_attribute(admin_id, "n_used_tokens", old_spend_token)
+        admin_snapshot.inc("n_used_tokens.n_input_tokens", n_input_tokens)
+        admin_snapshot.inc("n_used_tokens.n_output_tokens", n_output_tokens)
 
         # await db.update_n_used_tokens(admin_id, current_model, n_input_tokens, n_output_tokens)
 
@@ -1191,6 +1188,11 @@ async def _message_handle_admin(message: Message,
                        f"Отправьте команду /new чтобы создать новый диалог."
             await message.answer(text, parse_mode="HTML")
 
+    finally:
+        # every exit path, early returns included, persists what was recorded on the snapshot
+        if admin_snapshot is not None:
+            await admin_snapshot.flush()
+
 
 @admin.callback_query(AdminCheck(), F.data.startswith("good_"))
 async def good_answer_handle(callback: CallbackQuery):
@@ -1198,9 +1200,9 @@ async def good_answer_handle(callback: CallbackQuery):
 
     dialog_id = callback.data.split("_")[1] or None
 
-    await db.set_feedback(user_id=callback.from_user.id,
-                          dialog_id=dialog_id,
-                          feed=True)
+    await db.set_last_feedback(user_id=callback.from_user.id,
+                               dialog_id=dialog_id,
+                               feed=True)
 
 
 @admin.callback_query(AdminCheck(), F.data.startswith("bad_"))
@@ -1209,9 +1211,9 @@ async def bad_answer_handle(callback: CallbackQuery):
 
     dialog_id = callback.data.split("_")[1] or None
 
-    await db.set_feedback(user_id=callback.from_user.id,
-                          dialog_id=dialog_id,
-                          feed=True)
+    await db.set_last_feedback(user_id=callback.from_user.id,
+                               dialog_id=dialog_id,
+                               feed=True)
 
 
 @admin.message(AdminCheck(), F.in_([F.text, F.photo, F.video, F.document, F.voice]))
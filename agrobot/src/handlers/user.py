@@ -10,7 +10,7 @@ from src.config import Config
 from src.filters import UserCheck
 from src.nn import OpenAIHelper
 from src.utils import HELP_MESSAGE, is_previous_message_not_answered_yet, \
-    Stats, register_user, \
+    Stats, StreamRenderer, register_user, \
     MENU_TEXT, get_user_balance, \
     get_rate_data, RATE_TEXT, \
     ADD_SUBSCRIBE, is_phone, \
@@ -386,7 +386,7 @@ async def user_cancel_rate_handle(callback: CallbackQuery):
         text="✅ Ваш тарифный план успешно отменён!"
     )
 
-    await db.update_user(user_id=user_id)
+    await db.renew_user(user_id=user_id)
 
 
 @user.message(UserCheck(), Command("new"))
@@ -573,22 +573,30 @@ async def _message_handle_user(message: Message,
                                video: io.BytesIO = None,
                                context: str = None,
                                use_new_dialog_timeout: bool = True):
+    renderer = None
+    user_snapshot = None
     try:
 
         user_id = message.from_user.id
-        current_model = await db.get_user_attribute(user_id, "current_model")
+
+        await db.update_user(user_id=user_id)
+        user_snapshot = await db.get_user_snapshot(user_id, keys=["current_model",
+                                                                  "current_dialog_id",
+                                                                  "n_generate_seconds"])
+        current_model = user_snapshot.current_model
+        dialog_id = user_snapshot.current_dialog_id
+        dialog_messages = await db.get_recent_turns(user_id, Config.max_dialog_messages, dialog_id=dialog_id)
 
         if use_new_dialog_timeout:
-            last_message = await db.get_dialog_last(user_id=user_id)
+            last_message = dialog_messages[-1]["date"] if dialog_messages else datetime.now()
             if (datetime.now() - last_message).seconds > \
-                    Config.new_dialog_timeout and len(await db.get_dialog_messages(user_id=user_id)) > 0:
-                await db.start_new_dialog(user_id)
+                    Config.new_dialog_timeout and len(dialog_messages) > 0:
+                dialog_id = await db.start_new_dialog(user_id)
+                dialog_messages = []
 
                 await message.answer(f"🔄 Начало нового диалога из-за тайм-аута ",
                                      parse_mode="HTML")
 
-        await db.update_user(user_id=user_id)
-
         message_text = message.text
 
         if not message_text and (image or video or context):
@@ -599,8 +607,6 @@ async def _message_handle_user(message: Message,
                                  parse_mode="HTML")
             return
 
-        dialog_messages = await db.get_dialog_messages(user_id, dialog_id=None)
-
         if context is not None:
             message_text = f"Пользователь загрузил файл на анализ, ты должен проанализировать " \
                            f"содержимое файла и дать ответ на вопрос пользователя\nДанные из файла: {context}\n" \
@@ -610,21 +616,32 @@ async def _message_handle_user(message: Message,
                                                    parse_mode="HTML")
         await message.bot.send_chat_action(chat_id=user_id,
                                            action="typing")
+        renderer = StreamRenderer(bot=message.bot,
+                                  chat_id=user_id,
+                                  message_id=placeholder_message.message_id)
 
         answer, (n_input_tokens, n_output_tokens), n_first_dialog_messages_removed, is_voice = await openai_helper.send_message_assistant(
             message=message_text,
             dialog_messages=dialog_messages,
             image_buffer=image,
-            video_buffer=video
+            video_buffer=video,
+            on_delta=renderer.feed,
+            user_id=user_id,
+            dialog_id=dialog_id,
+            model=current_model
         )
 
         await asyncio.sleep(0.01)
     except asyncio.CancelledError:
+        if renderer is not None:
+            await renderer.abort()
         # await db.update_n_used_tokens(user_id, current_model, n_input_tokens, n_output_tokens)
         raise
 
     except Exception as e:
         logging.exception(e)
+        if renderer is not None:
+            await renderer.delete()
         await message.answer("❌  Хьюстон, у нас проблемы!\nЧто-то пошло не так при "
                              "обработке запроса!\nПопробуйте снова или обратитесь в тех. поддержку:",
                              reply_markup=get_help_keyboard(),
@@ -633,23 +650,17 @@ async def _message_handle_user(message: Message,
 
         if is_voice:
 
-            if await db.get_user_attribute(user_id=user_id, key="n_generate_seconds") <= 0:
+            if user_snapshot.n_generate_seconds <= 0:
                 await message.answer(
                     text=ADD_SUBSCRIBE,
                     parse_mode="HTML",
                     reply_markup=get_adds_kb()
                 )
-                await message.bot.edit_message_text(
-                    text=f"💬 Текстовый ответ: \n{answer}",
-                    chat_id=user_id,
-                    message_id=placeholder_message.message_id,
-                    parse_mode="HTML",
-                    reply_markup=get_feed_kb(user_id=user_id,
-                                             dialog_id=await db.get_user_attribute(user_id=user_id,
-                                                                                   key="current_dialog_id")))
+                await renderer.finish(f"💬 Текстовый ответ: \n{answer}",
+                                      reply_markup=get_feed_kb(user_id=user_id,
+                                                               dialog_id=dialog_id))
             else:
-                await message.bot.delete_message(chat_id=user_id,
-                                                 message_id=placeholder_message.message_id)
+                await renderer.delete()
 
                 audio_path, gen_second = await openai_helper.generate_speech(text=answer)
 
@@ -657,44 +668,37 @@ async def _message_handle_user(message: Message,
                     chat_id=user_id,
                     voice=audio_path,
                     reply_markup=get_feed_kb(user_id=user_id,
-                                             dialog_id=await db.get_user_attribute(user_id=user_id,
-                                                                                   key="current_dialog_id")))
+                                             dialog_id=dialog_id))
                 await db.update_spend(user_id=user_id,
                                       n_generate_seconds=gen_second)
 
         else:
 
-            await message.bot.edit_message_text(
-                text=answer,
-                chat_id=user_id,
-                message_id=placeholder_message.message_id,
-                parse_mode="HTML",
-                reply_markup=get_feed_kb(user_id=user_id,
-                                         dialog_id=await db.get_user_attribute(user_id=user_id,
-                                                                               key="current_dialog_id")))
+            await renderer.finish(answer,
+                                  reply_markup=get_feed_kb(user_id=user_id,
+                                                           dialog_id=dialog_id))
 
         new_dialog_message = {"user": [{"type": "text",
                                         "text": message_text}],
                               "bot": answer,
                               "date": datetime.now(),
                               "feed": None}
-        dialog_messages = await db.get_dialog_messages(user_id, dialog_id=None)
-
-        dialog_messages = dialog_messages[n_first_dialog_messages_removed:] + [new_dialog_message]
+        if n_first_dialog_messages_removed > 0:
+            max_messages = len(dialog_messages) - n_first_dialog_messages_removed + 1
+        else:
+            max_messages = Config.max_dialog_messages
 
-        await db.set_dialog_messages(
+        await db.append_dialog_turn(
             user_id=user_id,
-            dialog_messages=dialog_messages,
-            dialog_id=None
+            dialog_message=new_dialog_message,
+            dialog_id=dialog_id,
+            max_messages=max_messages
         )
         await db.update_spend(user_id=user_id,
                               n_used_tokens=n_input_tokens + n_output_tokens)
 
-        old_spend_token = await db.get_user_attribute(user_id, "n_used_tokens")
-        old_spend_token["n_input_tokens"] += n_input_tokens
-        old_spend_token["n_output_tokens"] += n_output_tokens
-
-        await db.set_user_attribute(user_id, "n_used_tokens", old_spend_token)
+        user_snapshot.inc("n_used_tokens.n_input_tokens", n_input_tokens)
+        user_snapshot.inc("n_used_tokens.n_output_tokens", n_output_tokens)
 
         # await db.update_n_used_tokens(user_id, current_model, n_input_tokens, n_output_tokens)
 
@@ -709,6 +713,11 @@ async def _message_handle_user(message: Message,
                        f"Отправьте команду /new чтобы создать новый диалог."
             await message.answer(text, parse_mode="HTML")
 
+    finally:
+        # every exit path, early returns included, persists what was recorded on the snapshot
+        if user_snapshot is not None:
+            await user_snapshot.flush()
+
 
 @user.callback_query(UserCheck(), F.data.startswith("good_"))
 async def good_answer_handle(callback: CallbackQuery):
@@ -716,9 +725,9 @@ async def good_answer_handle(callback: CallbackQuery):
 
     dialog_id = callback.data.split("_")[1] or None
 
-    await db.set_feedback(user_id=callback.from_user.id,
-                          dialog_id=dialog_id,
-                          feed=True)
+    await db.set_last_feedback(user_id=callback.from_user.id,
+                               dialog_id=dialog_id,
+                               feed=True)
 
 
 @user.callback_query(UserCheck(), F.data.startswith("bad_"))
@@ -727,9 +736,9 @@ async def bad_answer_handle(callback: CallbackQuery):
 
     dialog_id = callback.data.split("_")[1] or None
 
-    await db.set_feedback(user_id=callback.from_user.id,
-                          dialog_id=dialog_id,
-                          feed=True)
+    await db.set_last_feedback(user_id=callback.from_user.id,
+                               dialog_id=dialog_id,
+                               feed=True)
 
 
 @user.message(UserCheck(), F.in_([F.text, F.photo, F.video, F.document, F.voice]))
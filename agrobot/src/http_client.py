@@ -0,0 +1,105 @@
+from collections import defaultdict, deque
+from importlib.util import find_spec
+from typing import Optional
+from weakref import WeakKeyDictionary
+import logging
+import time
+
+import httpx
+
+from src.config import Config
+
+HTTP2_AVAILABLE = find_spec("h2") is not None
+
+
+class HostLatency:
+    def __init__(self, window: int = 500):
+        self.n_requests = 0
+        self.n_errors = 0
+        self.samples = deque(maxlen=window)
+
+    def add(self, seconds: float, is_error: bool = False):
+        self.n_requests += 1
+        self.n_errors += is_error
+        self.samples.append(seconds)
+
+    def add_error(self):
+        self.n_requests += 1
+        self.n_errors += 1
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {"n_requests": self.n_requests, "n_errors": self.n_errors, "avg_ms": 0.0, "p95_ms": 0.0}
+
+        return {
+            "n_requests": self.n_requests,
+            "n_errors": self.n_errors,
+            "avg_ms": 1000 * sum(samples) / len(samples),
+            "p95_ms": 1000 * samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        }
+
+
+class HttpClientRegistry:
+    def __init__(self,
+                 timeout: float = Config.http_timeout,
+                 connect_timeout: float = Config.http_connect_timeout,
+                 max_connections: int = Config.http_max_connections,
+                 max_keepalive_connections: int = Config.http_max_keepalive,
+                 keepalive_expiry: float = Config.http_keepalive_expiry):
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        self.clients = {}
+        self.latency = defaultdict(HostLatency)
+        self._started = WeakKeyDictionary()
+
+    async def _on_request(self, request: httpx.Request):
+        self._started[request] = time.monotonic()
+
+    async def _on_response(self, response: httpx.Response):
+        started = self._started.pop(response.request, None)
+        if started is not None:
+            self.latency[response.request.url.host].add(time.monotonic() - started,
+                                                        is_error=response.status_code >= 500)
+
+    def get(self, url: str, proxy: Optional[str] = None, timeout: Optional[httpx.Timeout] = None) -> httpx.AsyncClient:
+        # one pooled keep-alive client per upstream host (and proxy)
+        host = httpx.URL(url).host
+        if not host:
+            # a hostless key would open a client per path that is never reused
+            raise ValueError(f"Absolute http(s) url expected, got {url!r}")
+        key = (host, proxy)
+
+        client = self.clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(http2=HTTP2_AVAILABLE,
+                                       proxy=proxy,
+                                       timeout=timeout or self.timeout,
+                                       limits=self.limits,
+                                       event_hooks={"request": [self._on_request],
+                                                    "response": [self._on_response]})
+            self.clients[key] = client
+        return client
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        try:
+            return await self.get(url).request(method=method, url=url, **kwargs)
+        except httpx.HTTPError:
+            self.latency[httpx.URL(url).host].add_error()
+            raise
+
+    def latency_report(self):
+        return {host: latency.summary() for host, latency in sorted(self.latency.items())}
+
+    async def close(self):
+        for (host, _), client in list(self.clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logging.warning(f"HTTP client for {host} not closed: {e}")
+        self.clients.clear()
+
+
+HttpClients = HttpClientRegistry()
@@ -0,0 +1,70 @@
+from typing import List, Optional
+import hashlib
+import logging
+import re
+
+from src.config import Config
+from src.database import DataBase as db
+
+WORD_RE = re.compile(r"[a-zа-я0-9]+")
+STEM_LENGTH = 6
+# politeness and filler words only: question words (как/когда/чем) change the meaning
+STOPWORDS = {"пожалуйста", "подскажи", "подскажите", "скажи", "скажите", "мне", "а", "ну", "вот",
+             "привет", "здравствуйте", "добрый", "день", "вечер", "утро", "спасибо", "please"}
+
+
+class AnswerCache:
+    def __init__(self, max_prompt_length: int = Config.answer_cache_max_prompt_length):
+        self.max_prompt_length = max_prompt_length
+        self.n_hits = 0
+        self.n_misses = 0
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        words = WORD_RE.findall(message.lower().replace("ё", "е"))
+        # word order is kept: "томатов после огурцов" and "огурцов после томатов" are different questions
+        return " ".join(word[:STEM_LENGTH] for word in words if word not in STOPWORDS)
+
+    @staticmethod
+    def scope(vs_ids: List[str]) -> str:
+        return hashlib.sha1(",".join(sorted(vs_ids)).encode()).hexdigest()[:16]
+
+    def _key(self, message: str, vs_ids: List[str]):
+        return hashlib.sha1(f"{self.scope(vs_ids)}|{self.normalize(message)}".encode()).hexdigest()
+
+    def is_cacheable(self, message: Optional[str], dialog_messages: list, *media) -> bool:
+        # answers inside a dialog depend on its history, only standalone text questions are shared
+        return bool(message) and len(message) <= self.max_prompt_length \
+            and not dialog_messages and all(item is None for item in media) \
+            and bool(self.normalize(message))
+
+    async def get(self, message: str, vs_ids: List[str]) -> Optional[str]:
+        try:
+            entry = await db.get_cached_answer(self._key(message, vs_ids))
+        except Exception as e:
+            logging.warning(f"Answer cache lookup failed: {e}")
+            entry = None
+
+        if entry is None:
+            self.n_misses += 1
+            return None
+
+        self.n_hits += 1
+        return entry["answer"]
+
+    async def set(self, message: str, vs_ids: List[str], answer: str):
+        try:
+            await db.set_cached_answer(key=self._key(message, vs_ids),
+                                       scope=self.scope(vs_ids),
+                                       prompt=self.normalize(message),
+                                       answer=answer)
+        except Exception as e:
+            logging.warning(f"Answer cache store failed: {e}")
+
+    @property
+    def hit_rate(self) -> float:
+        n_lookups = self.n_hits + self.n_misses
+        return self.n_hits / n_lookups if n_lookups else 0.0
+
+
+Answers = AnswerCache()
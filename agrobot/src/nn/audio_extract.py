@@ -0,0 +1,82 @@
+from typing import List, Optional, Tuple
+import asyncio
+import io
+import re
+
+from src.config import Config
+
+# Whisper resamples to 16 kHz mono anyway, so anything richer is only upload weight
+SAMPLE_RATE = 16000
+AUDIO_NAME = "audio.ogg"
+
+DURATION_PATTERN = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+SILENCE_START_PATTERN = re.compile(r"silence_start: (-?\d+(?:\.\d+)?)")
+SILENCE_END_PATTERN = re.compile(r"silence_end: (-?\d+(?:\.\d+)?)")
+
+
+class AudioExtractionError(Exception):
+    pass
+
+
+async def extract_audio(video_path: str, bitrate: str = Config.audio_bitrate,
+                        start: Optional[float] = None, duration: Optional[float] = None) -> io.BytesIO:
+    window = []
+    if start is not None:
+        window += ["-ss", f"{start:.3f}"]
+    if duration is not None:
+        window += ["-t", f"{duration:.3f}"]
+
+    process = await asyncio.create_subprocess_exec(
+        Config.ffmpeg_path, "-nostdin", "-hide_banner", "-loglevel", "error",
+        *window, "-i", video_path,
+        "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE),
+        "-c:a", "libopus", "-b:a", bitrate, "-application", "voip",
+        "-f", "ogg", "pipe:1",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+
+    if process.returncode != 0 or not stdout:
+        raise AudioExtractionError(f"ffmpeg exited with {process.returncode}: "
+                                   f"{stderr.decode('utf-8', errors='ignore').strip()}")
+
+    audio = io.BytesIO(stdout)
+    audio.name = AUDIO_NAME
+    return audio
+
+
+async def detect_silences(video_path: str, noise_db: float = Config.silence_noise_db,
+                          min_duration: float = Config.silence_min_duration) -> Tuple[float, List[float]]:
+    # one decode pass with silencedetect; returns the media duration and the midpoints of silent stretches
+    process = await asyncio.create_subprocess_exec(
+        Config.ffmpeg_path, "-nostdin", "-hide_banner",
+        "-i", video_path,
+        "-vn", "-af", f"silencedetect=noise={noise_db}dB:d={min_duration}",
+        "-f", "null", "-",
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+
+    log = stderr.decode("utf-8", errors="ignore")
+    match = DURATION_PATTERN.search(log)
+    if process.returncode != 0 or match is None:
+        raise AudioExtractionError(f"ffmpeg exited with {process.returncode}: {log[-500:].strip()}")
+
+    hours, minutes, seconds = match.groups()
+    duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    starts = [float(value) for value in SILENCE_START_PATTERN.findall(log)]
+    ends = [float(value) for value in SILENCE_END_PATTERN.findall(log)]
+    return duration, [(start + end) / 2 for start, end in zip(starts, ends)]
@@ -0,0 +1,47 @@
+from typing import List, Optional, Tuple
+
+from src.config import Config
+from src.nn.tokens import count_tokens, count_tokens_batch, get_overhead
+
+
+def message_text(content) -> str:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return "\n".join(part.get("text", "") for part in content
+                     if isinstance(part, dict) and part.get("type") == "text")
+
+
+class ContextWindow:
+    def __init__(self, model: str = "gpt-4o", budget: Optional[int] = None):
+        self.model = model or "gpt-4o"
+        self.budget = budget or Config.context_token_budgets.get(self.model, Config.context_token_budget)
+        self.tokens_per_message, _ = get_overhead(self.model)
+
+    def count_message(self, content) -> int:
+        return self.tokens_per_message + count_tokens(message_text(content), self.model)
+
+    def count_turns(self, dialog_messages: List[dict]) -> List[int]:
+        texts = []
+        for dialog_message in dialog_messages:
+            texts.append(message_text(dialog_message["user"]))
+            texts.append(message_text(dialog_message["bot"]))
+
+        n_tokens = count_tokens_batch(texts, self.model)
+        return [2 * self.tokens_per_message + n_tokens[2 * i] + n_tokens[2 * i + 1]
+                for i in range(len(dialog_messages))]
+
+    def fit(self, dialog_messages: List[dict], reserved_tokens: int = 0) -> Tuple[List[dict], int]:
+        # keeps the newest turns that fit into the budget, the oldest ones are dropped
+        available = self.budget - reserved_tokens
+        n_kept, n_used_tokens = 0, 0
+
+        for n_tokens in reversed(self.count_turns(dialog_messages)):
+            if n_used_tokens + n_tokens > available:
+                break
+            n_used_tokens += n_tokens
+            n_kept += 1
+
+        n_removed = len(dialog_messages) - n_kept
+        return dialog_messages[n_removed:], n_removed
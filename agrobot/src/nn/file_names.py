@@ -0,0 +1,57 @@
+from typing import Dict, List
+import asyncio
+import logging
+
+from src.config import Config
+from src.database import DataBase as db
+
+
+class FileNameCache:
+    def __init__(self, concurrency: int = Config.file_lookup_concurrency):
+        self.names = {}
+        self.concurrency = concurrency
+
+    async def remember(self, names: Dict[str, str]):
+        names = {file_id: name for file_id, name in names.items() if self.names.get(file_id) != name}
+        if not names:
+            return
+
+        self.names.update(names)
+        await db.add_file_names(names)
+
+    async def sync(self, client):
+        # full reconciliation with the account's files, run once at startup
+        names = {}
+        try:
+            async for file_ in client.files.list(purpose="assistants"):
+                names[file_.id] = file_.filename
+        except Exception as e:
+            logging.warning(f"File names not synced: {e}")
+        await self.remember(names)
+
+    async def resolve(self, client, file_ids: List[str]) -> Dict[str, str]:
+        missing = list({file_id for file_id in file_ids if file_id not in self.names})
+
+        if missing:
+            stored = await db.get_file_names(missing)
+            self.names.update(stored)
+            missing = [file_id for file_id in missing if file_id not in stored]
+
+        if missing:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def _retrieve(file_id):
+                async with semaphore:
+                    try:
+                        return file_id, (await client.files.retrieve(file_id)).filename
+                    except Exception as e:
+                        logging.warning(f"File {file_id} name not resolved: {e}")
+                        return file_id, None
+
+            retrieved = await asyncio.gather(*[_retrieve(file_id) for file_id in missing])
+            await self.remember({file_id: name for file_id, name in retrieved if name is not None})
+
+        return {file_id: self.names.get(file_id, file_id) for file_id in file_ids}
+
+
+FileNames = FileNameCache()
@@ -1,12 +1,13 @@
-import aiohttp
 import asyncio
 from bs4 import BeautifulSoup
 import aiofiles
+import httpx
 import requests
 import matplotlib.pyplot as plt
 from PIL import Image
 from io import BytesIO
 from src.config import Config
+from src.http_client import HttpClients
 
 
 def is_in(a, b):
@@ -45,15 +46,9 @@ async def get_text_image(response):
 
 
 async def async_post_with_files(url, data, files):
-    async with aiohttp.ClientSession() as session:
-        form_data = aiohttp.FormData()
-        for key, value in data.items():
-            form_data.add_field(key, value)
-        for file_name, file_content in files.items():
-            form_data.add_field(file_name, file_content, filename=file_name)
-
-        async with session.post(url, data=form_data) as response:
-            return await response.text()
+    files = {file_name: (file_name, file_content) for file_name, file_content in files.items()}
+    response = await HttpClients.request("POST", url, data=data, files=files)
+    return response.text
 
 
 async def get_diseases_colab(filepath: str, *, prompt: str = "", lang: str = "ru"):
@@ -61,15 +56,16 @@ async def get_diseases_colab(filepath: str, *, prompt: str = "", lang: str = "ru
     url = Config.diseases_url
     data = {"text_desc": prompt, "pdd": "2", "lang": lang}
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(filepath) as resp:
-                if resp.status == 200:
-                    file_content = await resp.read()
-                    files = {"xfile1": file_content}
-    except:
-        file_content = await aiofiles.open(filepath, "rb")
-        files = {"xfile1": file_content}
+    source = httpx.URL(filepath)
+    if source.scheme in ("http", "https"):
+        # keyed by scheme and host, so every image url reuses the same pooled client
+        base_url = f"{source.scheme}://{source.netloc.decode()}"
+        resp = await HttpClients.get(base_url).get(filepath)
+        resp.raise_for_status()
+        files = {"xfile1": resp.content}
+    else:
+        async with aiofiles.open(filepath, "rb") as file:
+            files = {"xfile1": await file.read()}
 
     response_text = await async_post_with_files(url, data, files)
     text, images = await get_text_image(response_text)
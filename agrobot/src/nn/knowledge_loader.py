@@ -3,8 +3,9 @@ from src.database import DataBase as db
 import openai
 import io
 import logging
-import httpx
-from moviepy.editor import VideoFileClip
+from src.http_client import HttpClients
+from src.nn.file_names import FileNames
+from src.nn.transcriber import ChunkedTranscriber
 from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import aiofiles
@@ -15,32 +16,52 @@ from pytube import YouTube, Playlist
 import uuid
 from bs4 import BeautifulSoup
 import re
-import aiohttp
 
 
 class KnowledgeLoader:
 
     def __init__(self):
-        proxy = Config.proxies
-        if proxy is not None:
-            self.http_client_openai = httpx.AsyncClient(proxies=proxy)
-            self.client = openai.AsyncOpenAI(api_key=Config.openai_api_key, http_client=self.http_client_openai)
-        else:
-            self.client = openai.AsyncOpenAI(api_key=Config.openai_api_key)
+        proxy = Config.proxies[0] if Config.proxies else None
+        self.http_client_openai = HttpClients.get("https://api.openai.com", proxy=proxy)
+        # the SDK would otherwise inherit the pooled client's short timeout
+        self.client = openai.AsyncOpenAI(api_key=Config.openai_api_key, http_client=self.http_client_openai,
+                                         timeout=Config.openai_timeout)
 
         self.executor_pool = ThreadPoolExecutor()
-        self.http_client = httpx.AsyncClient()
+        self.transcriber = ChunkedTranscriber(self.client, prompt=Config.whisper_prompt)
+
+    async def _upload_to_vector_store(self, vector_store_id: str, files: list):
+        # what file_batches.upload_and_poll does, but the uploaded names go straight to the citation cache
+        semaphore = asyncio.Semaphore(Config.file_lookup_concurrency)
+
+        async def _upload(file):
+            async with semaphore:
+                return await self.client.files.create(file=file, purpose="assistants")
+
+        uploaded = await asyncio.gather(*[_upload(file) for file in files])
+        await FileNames.remember({file.id: file.filename for file in uploaded})
+
+        batch = await self.client.beta.vector_stores.file_batches.create_and_poll(
+            vector_store_id=vector_store_id,
+            file_ids=[file.id for file in uploaded]
+        )
+        # cached answers were built without the new files
+        await db.clear_answer_cache()
+        return batch
+
+    async def sync_file_names(self):
+        await FileNames.sync(self.client)
 
     async def transcribe(self, file: io.BytesIO):
 
         try:
             # with open(file, "rb") as audio:
             file.seek(0)  # Reset the file pointer to the beginning
-            file.name = "temp.mp3"
+            file_name = getattr(file, "name", None) or "temp.mp3"
             audio_content = file.read()
             prompt_text = Config.whisper_prompt
             result = await self.client.audio.transcriptions.create(model="whisper-1",
-                                                                   file=("temp." + "mp3", audio_content, "audio/mp3"),
+                                                                   file=(file_name, audio_content),
                                                                    prompt=prompt_text)
             # print(result.text)
             return result.text
@@ -49,36 +70,6 @@ class KnowledgeLoader:
             logging.exception(e)
             raise Exception(f"⚠️ _'error'._ ⚠️\n{str(e)}") from e
 
-    async def _get_audio_from_video(self, video_data: str) -> io.BytesIO:
-        try:
-            # Create a BytesIO object to hold the audio data
-            # audio_data = io.BytesIO()
-            async with aiofiles.tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as temp_audio:
-                name = temp_audio.name
-
-            def _get_audio(path_video):
-                clip = VideoFileClip(path_video)
-                clip.audio.write_audiofile(name, codec="mp3", bitrate="32k")
-                clip.audio.close()
-                clip.close()
-
-                with open(name, "rb") as audio_tfile:
-                    audio_data = io.BytesIO(audio_tfile.read())
-                    audio_data.seek(0)
-
-                return audio_data
-                # _data.seek(0)
-
-            audio_data = await asyncio.get_event_loop().run_in_executor(self.executor_pool, _get_audio, video_data)
-            await aiofiles.os.remove(video_data)
-            await aiofiles.os.remove(name)
-
-            return audio_data
-
-        except Exception as e:
-            logging.exception(e)
-            raise Exception(f"⚠️ _'error'._ ⚠️\n{str(e)}") from e
-
     async def download_video(self, url, output_path="videos"):
 
         def _download():
@@ -101,9 +92,13 @@ class KnowledgeLoader:
 
         file_path = await self.download_video(url, output_path)
 
-        audio = await self._get_audio_from_video(file_path)
-
-        transcription = await self.transcribe(audio)
+        try:
+            transcription = await self.transcriber.transcribe(file_path)
+        except Exception as e:
+            logging.exception(e)
+            raise Exception(f"⚠️ _'error'._ ⚠️\n{str(e)}") from e
+        finally:
+            await aiofiles.os.remove(file_path)
 
         transcription = io.BytesIO(transcription.encode("utf-8"))
         fname = f'{file_path.split("/")[-1].split(".")[0]}.txt'  # f"agronomical_video_{str(uuid.uuid4())}.txt"
@@ -134,10 +129,7 @@ class KnowledgeLoader:
                 transcriptions = [transcription]
 
             vector_store = await self.client.beta.vector_stores.create(name=vectorstore_name)
-            batch = await self.client.beta.vector_stores.file_batches.upload_and_poll(
-                vector_store_id=vector_store.id,
-                files=transcriptions
-            )
+            batch = await self._upload_to_vector_store(vector_store.id, transcriptions)
 
             await db.add_new_vs(vector_store.id)
 
@@ -160,10 +152,7 @@ class KnowledgeLoader:
 
             vector_store = await self.client.beta.vector_stores.create(name=vectorstore_name)
             data = open(name_of_file, "rb")
-            batch = await self.client.beta.vector_stores.file_batches.upload_and_poll(
-                vector_store_id=vector_store.id,
-                files=[data]
-            )
+            batch = await self._upload_to_vector_store(vector_store.id, [data])
             data.close()
             await aiofiles.os.remove(name_of_file)
             await db.add_new_vs(vector_store.id)
@@ -175,45 +164,41 @@ class KnowledgeLoader:
             return vector_store.id
 
     async def download_file_gdrive(self, url):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
+        response = await HttpClients.request("GET", url, follow_redirects=True)
 
-                if 'Content-Disposition' in response.headers:
-                    content_disposition = response.headers['Content-Disposition']
-                    fname = re.findall('filename=(.+)', content_disposition)[0].replace('"', '')
+        if 'Content-Disposition' in response.headers:
+            content_disposition = response.headers['Content-Disposition']
+            fname = re.findall('filename=(.+)', content_disposition)[0].replace('"', '')
 
-                else:
-                    logging.warning("Content-Disposition header not found. Cannot determine filename.")
-                    fname = f"unnamed_gdrive_data_{str(uuid.uuid4())}.txt"
-                r_content = await response.read()
-                buf = io.BytesIO(r_content)
-                async with aiofiles.open(fname, "wb") as f:
-                    await f.write(buf.getbuffer())
-
-            data = open(fname, "rb")
-            data.close()
-            await aiofiles.os.remove(fname)
-            return data
+        else:
+            logging.warning("Content-Disposition header not found. Cannot determine filename.")
+            fname = f"unnamed_gdrive_data_{str(uuid.uuid4())}.txt"
+        buf = io.BytesIO(response.content)
+        async with aiofiles.open(fname, "wb") as f:
+            await f.write(buf.getbuffer())
+
+        data = open(fname, "rb")
+        data.close()
+        await aiofiles.os.remove(fname)
+        return data
 
     async def gather_files_from_gfolder(self, folder_url):
-        async with self.http_client as client:
-            response = await client.get(folder_url, )
-            response.raise_for_status()
+        response = await HttpClients.request("GET", folder_url, follow_redirects=True)
+        response.raise_for_status()
 
-            ids = []
+        ids = []
 
-            def _get_ids(page):
-                nonlocal ids
-                soup = BeautifulSoup(page, 'html.parser')
-                file_links = soup.find_all("div", class_="WYuW0e Ss7qXc")
-                ids = [u['data-id'] for u in file_links]
+        def _get_ids(page):
+            nonlocal ids
+            soup = BeautifulSoup(page, 'html.parser')
+            file_links = soup.find_all("div", class_="WYuW0e Ss7qXc")
+            ids = [u['data-id'] for u in file_links]
 
-            loop = asyncio.get_event_loop()
-            content = response.read()
-            text = content.decode("utf-8")
-            await loop.run_in_executor(self.executor_pool, _get_ids, text)
+        loop = asyncio.get_event_loop()
+        text = response.content.decode("utf-8")
+        await loop.run_in_executor(self.executor_pool, _get_ids, text)
 
-            return await self.process_gurl(file_ids=ids)
+        return await self.process_gurl(file_ids=ids)
 
     @staticmethod
     async def process_gurl(gdrive_url: str | None = None, file_ids: List[str] | None = None):
@@ -249,10 +234,7 @@ class KnowledgeLoader:
 
             vector_store = await self.client.beta.vector_stores.create(name=vectorstore_name)
 
-            batch = await self.client.beta.vector_stores.file_batches.upload_and_poll(
-                vector_store_id=vector_store.id,
-                files=contents
-            )
+            batch = await self._upload_to_vector_store(vector_store.id, contents)
             await db.add_new_vs(vector_store.id)
 
         except Exception as e:
@@ -287,10 +269,7 @@ class KnowledgeLoader:
             contents = [await self.download_file_gdrive(url) for url in file_urls]
 
             vector_store = await self.client.beta.vector_stores.create(name=vectorstore_name)
-            batch = await self.client.beta.vector_stores.file_batches.upload_and_poll(
-                vector_store_id=vector_store.id,
-                files=contents
-            )
+            batch = await self._upload_to_vector_store(vector_store.id, contents)
             await db.add_new_partner(vector_store.id)
 
         except Exception as e:
@@ -1,31 +1,37 @@
 from src.config import Config
 import openai
-import tiktoken
 from src.database import DataBase as db
 import io
 import logging
 from src.nn.get_diseases import get_diseases_tg
-import httpx
-from moviepy.editor import VideoFileClip
-import cv2
+from src.nn.run_executor import RunExecutor, RunResult
+from src.nn.voice_intent import VoiceIntentDetector
+from src.nn.context_window import ContextWindow
+from src.nn.tokens import count_prompt_tokens, count_dialog_tokens
+from src.nn.answer_cache import Answers
+from src.nn.file_names import FileNames
+from src.nn.audio_extract import extract_audio
+from src.nn.stage_timings import VideoTimings
+from src.nn.video_frames import Frames, frame_to_data_url
+from src.http_client import HttpClients
 from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import base64
+import re
+import time
 import aiofiles
 import aiofiles.os
-from typing import List, Optional
-import json
+from typing import List, Optional, Callable, Awaitable
 from tinytag import TinyTag
 
 
 class OpenAIHelper:
     def __init__(self) -> None:
-        proxy = Config.proxies
-        if proxy is not None:
-            self.http_client = httpx.AsyncClient(proxies=proxy)
-            self.client = openai.AsyncOpenAI(api_key=Config.openai_api_key, http_client=self.http_client)
-        else:
-            self.client = openai.AsyncOpenAI(api_key=Config.openai_api_key)
+        proxy = Config.proxies[0] if Config.proxies else None
+        self.http_client = HttpClients.get("https://api.openai.com", proxy=proxy)
+        # the SDK would otherwise inherit the pooled client's short timeout
+        self.client = openai.AsyncOpenAI(api_key=Config.openai_api_key, http_client=self.http_client,
+                                         timeout=Config.openai_timeout)
         self.executor_pool = ThreadPoolExecutor()
         self.OPENAI_COMPLETION_OPTIONS = {
             'temperature': 0.55,
@@ -41,27 +47,28 @@ class OpenAIHelper:
             "get_answer_web": self.get_answer_web,
         }
         self.partner_extend_prompt = Config.partner_extend_prompt
+        self.run_executor = RunExecutor(self.client.beta.threads.runs, self.tools_dict)
+        self.voice_intent = VoiceIntentDetector(Config.voice_intent_model_path)
 
     async def search_google(self, queries: List[str]):
-        async with httpx.AsyncClient() as client:
-            tasks = []
-            for query in queries:
-                params = {
-                    "engine": "google",
-                    "q": query,
-                    "api_key": self.serp_api_key,
-                    "num": 10
-                }
-                tasks.append(client.get("https://serpapi.com/search", params=params, timeout=None))
+        tasks = []
+        for query in queries:
+            params = {
+                "engine": "google",
+                "q": query,
+                "api_key": self.serp_api_key,
+                "num": 10
+            }
+            tasks.append(HttpClients.request("GET", "https://serpapi.com/search", params=params))
 
-            responses = await asyncio.gather(*tasks)
+        responses = await asyncio.gather(*tasks)
 
-            results = []
-            for response in responses:
-                response.raise_for_status()
-                results.append(response.json().get('organic_results', []))
+        results = []
+        for response in responses:
+            response.raise_for_status()
+            results.append(response.json().get('organic_results', []))
 
-            return results
+        return results
 
     async def get_answer_web(self, query: List[str]):
         search_results_list = await self.search_google(query)
@@ -116,11 +123,11 @@ class OpenAIHelper:
         try:
             # with open(file, "rb") as audio:
             file.seek(0)  # Reset the file pointer to the beginning
-            file.name = "temp.mp3"
+            file_name = getattr(file, "name", None) or "temp.mp3"
             audio_content = file.read()
             prompt_text = ""
             result = await self.client.audio.transcriptions.create(model="whisper-1",
-                                                                   file=("temp." + "mp3", audio_content, "audio/mp3"),
+                                                                   file=(file_name, audio_content),
                                                                    prompt=prompt_text)
             # print(result.text)
             return result.text
@@ -129,48 +136,45 @@ class OpenAIHelper:
             logging.exception(e)
             raise Exception(f"⚠️ _'error'._ ⚠️\n{str(e)}") from e
 
-    async def _get_frames_audio_from_video(self, video_data: io.BytesIO, seconds_per_frame: int = 1):
+    async def _get_frames_text_from_video(self, video_data: io.BytesIO, seconds_per_frame: int = 1):
+        # frame sampling runs in the process pool while ffmpeg demuxes audio and Whisper transcribes it
+        name = None
+        tasks = []
+        started = time.monotonic()
         try:
-            base64Frames = []
             async with aiofiles.tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_video:
                 await temp_video.write(video_data.getvalue())
                 name = temp_video.name
 
-            video = cv2.VideoCapture(name)
-
-            total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-            fps = video.get(cv2.CAP_PROP_FPS)
-            frames_to_skip = int(fps * seconds_per_frame)
-            curr_frame = 0
-
-            loop = asyncio.get_event_loop()
-            while curr_frame < total_frames - 1:
-                video.set(cv2.CAP_PROP_POS_FRAMES, curr_frame)
-                success, frame = await loop.run_in_executor(self.executor_pool, video.read)
-                if not success:
-                    break
-                _, buffer = cv2.imencode(".jpg", frame)
-                base64Frames.append(base64.b64encode(buffer).decode("utf-8"))
-                curr_frame += frames_to_skip
-            video.release()
-            audio_data = io.BytesIO()
-
-            def _get_audio(path_video, _data: io.BytesIO):
-                clip = VideoFileClip(path_video)
-                clip.audio.write_audiofile(_data, codec="mp3", bitrate="32k")
-                clip.audio.close()
-                clip.close()
-                _data.seek(0)
-
-            await loop.run_in_executor(self.executor_pool, _get_audio, name, audio_data)
-            await aiofiles.os.remove(name)
-
-            return base64Frames, audio_data
+            async def _audio_text():
+                audio_data = await VideoTimings.timed("audio", extract_audio(name))
+                return await VideoTimings.timed("transcribe", self.transcribe(audio_data))
+
+            tasks = [
+                asyncio.create_task(VideoTimings.timed("frames", Frames.sample(name, seconds_per_frame))),
+                asyncio.create_task(_audio_text())
+            ]
+            sampled, text_from_audio = await asyncio.gather(*tasks)
+
+            return sampled.frames, text_from_audio
 
         except Exception as e:
             logging.exception(e)
             raise Exception(f"⚠️ _'error'._ ⚠️\n{str(e)}") from e
 
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            if name is not None:
+                await aiofiles.os.remove(name)
+            VideoTimings.add("total", time.monotonic() - started)
+
+    @staticmethod
+    def _frame_parts(frames: List[bytes]) -> List[dict]:
+        return [{"type": "image_url", "image_url": {"url": frame_to_data_url(frame), "detail": "low"}}
+                for frame in frames]
+
     @staticmethod
     async def is_need_voice_message(message: str):
 
@@ -191,46 +195,39 @@ class OpenAIHelper:
         return message
 
     async def is_need_voice(self, message: str, model: str = "gpt-3.5-turbo"):
-        answer = None
-        while answer is None:
-            try:
-
-                if message == "":
-                    return False
+        if not message:
+            return False
 
-                message = await self.is_need_voice_message(message)
-                print(message)
+        is_voice, confidence = self.voice_intent(message)
+        if confidence >= Config.voice_intent_confidence:
+            return is_voice
 
-                r = await self.client.chat.completions.create(
-                    model=model,
-                    messages=message,
-                    temperature=0.0
-                )
-                answer = r.choices[0].message.content
-
-                return bool(int(answer)) if answer in ["0", "1"] else False
+        try:
+            r = await self.client.chat.completions.create(
+                model=model,
+                messages=await self.is_need_voice_message(message),
+                temperature=0.0
+            )
+            answer = r.choices[0].message.content
 
-                # n_input_tokens, n_output_tokens = r_gen.usage.prompt_tokens, r_gen.usage.completion_tokens
+            return bool(int(answer)) if answer in ["0", "1"] else False
 
-            except Exception as e:
-                logging.exception(e)
-                raise Exception(f"⚠️ _'error'._ ⚠️\n{str(e)}") from e
+        except Exception as e:
+            logging.exception(e)
+            raise Exception(f"⚠️ _'error'._ ⚠️\n{str(e)}") from e
 
     async def analyze_video(self, video: io.BytesIO, message: str = "", model: str = "gpt-4o"):
 
-        frames, audio_buf = await self._get_frames_audio_from_video(video)
-        text_from_audio = await self.transcribe(audio_buf)
-        is_voice = False
-
-        if message is not None:
-            is_voice = await self.is_need_voice(message)
+        (frames, text_from_audio), is_voice = await asyncio.gather(
+            self._get_frames_text_from_video(video),
+            VideoTimings.timed("voice", self._with_default(self.is_need_voice(message), False))
+        )
         messages = [
             {"role": "system",
              "content": "Ты передовой бот для анализа и ответа на вопросы на основе видео. Отвечай в формате Markdown"},
             {"role": "user", "content": [
-                "Вот кадры из видео:",
-                *map(lambda x: {"type": "image_url",
-                                "image_url": {"url": f'data:image/jpg;base64,{x}', "detail": "low"}}, frames),
+                {"type": "text", "text": "Вот кадры из видео:"},
+                *self._frame_parts(frames),
                 {"type": "text", "text": f"Текст из видео: {text_from_audio}"},
                 {"type": "text", "text": f"Пользователь: {message}"}
             ],
@@ -245,19 +242,14 @@ class OpenAIHelper:
         n_input_tokens, n_output_tokens = r.usage.prompt_tokens, r.usage.completion_tokens
         return r.choices[0].message.content, (n_input_tokens, n_output_tokens), is_voice
 
-    async def get_video_prompt(self, video: io.BytesIO, message: str = ""):
-        frames, audio_buf = await self._get_frames_audio_from_video(video)
-        text_from_audio = await self.transcribe(audio_buf)
-        message_video = [
-            {"role": "user", "content": [
-                "Вот кадры из видео:",
-                *map(lambda x: {"type": "image_url",
-                                "image_url": {"url": f'data:image/jpg;base64,{x}', "detail": "low"}}, frames),
-                {"type": "text", "text": f"Текст из видео: {text_from_audio}"},
-                {"type": "text", "text": f"Пользователь: {message}\nОтвечай в формате Markdown"}
-            ],
-             }]
-        return message_video
+    async def get_video_prompt(self, video: io.BytesIO):
+        frames, text_from_audio = await self._get_frames_text_from_video(video)
+        video_content = [
+            {"type": "text", "text": "Вот кадры из видео:"},
+            *self._frame_parts(frames),
+            {"type": "text", "text": f"Текст из видео: {text_from_audio}"}
+        ]
+        return video_content
 
     @staticmethod
     async def get_diseases_web(image=None, prompt: str = "", lang: str = "ru"):
@@ -303,19 +295,8 @@ class OpenAIHelper:
 
         return messages
 
-    async def _generate_prompt_messages_assistant(self, message,
-                                                  dialog_messages: Optional[list] = None,
-                                                  image_path: Optional[str] = None,
-                                                  video_buffer: Optional[io.BytesIO] = None):
-
-        messages = []
-        if dialog_messages is not None:
-            for dialog_message in dialog_messages[3:]:
-                print(dialog_message["feed"])
-                if dialog_message["feed"] or dialog_message["feed"] is None:
-                    messages.append({"role": "user", "content": dialog_message["user"]})
-                    messages.append({"role": "assistant", "content": dialog_message["bot"]})
-
+    async def _prepare_media(self, image_path: Optional[str] = None,
+                             video_buffer: Optional[io.BytesIO] = None):
         if image_path is not None:
             image_data = open(image_path, "rb")
             image_file = await self.client.files.create(
@@ -326,6 +307,26 @@ class OpenAIHelper:
             image_data.close()
 
             await aiofiles.os.remove(image_path)
+            return [{"type": "image_file", "image_file": {"file_id": image_file.id}}]
+
+        if video_buffer is not None:
+            return await self.get_video_prompt(video=video_buffer)
+
+        return []
+
+    @staticmethod
+    def _generate_prompt_messages_assistant(message,
+                                            dialog_messages: Optional[list] = None,
+                                            media_content: Optional[list] = None):
+
+        messages = []
+        if dialog_messages is not None:
+            for dialog_message in dialog_messages:
+                if dialog_message["feed"] or dialog_message["feed"] is None:
+                    messages.append({"role": "user", "content": dialog_message["user"]})
+                    messages.append({"role": "assistant", "content": dialog_message["bot"]})
+
+        if media_content:
             messages.append(
                 {
                     "role": "user",
@@ -334,23 +335,13 @@ class OpenAIHelper:
                             "type": "text",
                             "text": message if message is not None else "Нет сообщения",
                         },
-                        {
-                            "type": "image_file",
-                            "image_file": {"file_id": image_file.id},
-                        }
+                        *media_content
                     ]
                 }
             )
-            print(messages)
             return messages
 
-        if video_buffer is not None:
-            messages.append(await self.get_video_prompt(video=video_buffer,
-                                                        message=message))
-            print(messages)
-            return messages
         messages.append({"role": "user", "content": message})
-        print(messages)
         return messages
 
     @staticmethod
@@ -359,235 +350,201 @@ class OpenAIHelper:
 
     @staticmethod
     def _count_tokens_from_prompt(prompt, answer, model="gpt-4o"):
-        encoding = tiktoken.encoding_for_model(model)
-
-        n_input_tokens = len(encoding.encode(prompt)) + 1
-        n_output_tokens = len(encoding.encode(answer))
-
-        return n_input_tokens, n_output_tokens
+        return count_prompt_tokens(prompt, answer, model)
 
     @staticmethod
     def _postprocess_answer(answer):
         answer = answer.strip()
         return answer
 
-    async def partner_answer_assistant(self, message: str,
-                                       image_buffer: io.BytesIO = None,
-                                       video_buffer: io.BytesIO = None
-                                       ):
-        partner_vs = await db.get_all_partners()
-        is_voice = await self.is_need_voice(message)
-
-        if partner_vs == []:
-            return message, 0, 0, is_voice
+    async def _format_citations(self, result: RunResult):
+        file_ids = [annotation.file_citation.file_id for annotation in result.annotations
+                    if getattr(annotation, "file_citation", None)]
+        file_names = await FileNames.resolve(self.client, file_ids)
 
-        answer = None
-        while answer is None:
-            try:
-                message += self.partner_extend_prompt
+        markers = {}
+        citations = []
+        for i, annotation in enumerate(result.annotations):
+            markers.setdefault(annotation.text, f"[{i}]")
+            if file_citation := getattr(annotation, "file_citation", None):
+                citations.append(f"[{i}]: {file_names[file_citation.file_id]}")
 
-                messages = await self._generate_prompt_messages_assistant(message=message,
-                                                                          video_buffer=video_buffer,
-                                                                          image_path=image_buffer)
-                thread = await self.client.beta.threads.create(tool_resources={
-                    "file_search": {"vector_store_ids": partner_vs}},
-                    messages=messages)
+        answer = result.text
+        if markers:
+            pattern = re.compile("|".join(map(re.escape, sorted(markers, key=len, reverse=True))))
+            answer = pattern.sub(lambda match: markers[match.group(0)], answer)
 
-                run = await self.client.beta.threads.runs.create_and_poll(thread_id=thread.id,
-                                                                          assistant_id=self.assistant_id)
+        return answer, citations
 
-                async def _wait_on_run(_run, _thread):
-
-                    while _run.status in ["queued", "in_progress"]:
-                        _run = await self.client.beta.threads.runs.retrieve(
-                            thread_id=_thread.id,
-                            run_id=_run.id
-                        )
-                        await asyncio.sleep(0.5)
-                    return _run
-
-                run = await _wait_on_run(run, thread)
+    @staticmethod
+    def _stream_unless_voice(on_delta: Callable[[str], Awaitable], voice_task: asyncio.Task):
+        # a voice reply replaces the text, so there is nothing to stream
+        async def _on_delta(delta: str):
+            if not await voice_task:
+                await on_delta(delta)
 
-                if run.status == "completed":
-                    messages = list(await self.client.beta.threads.messages.list(
-                        thread_id=thread.id,
-                        run_id=run.id
-                    ))
-                    message_content = messages[0].content[0].text
-                    annotations = message_content.annotations
-                    citations = []
+        return _on_delta
 
-                    for i, annotation in enumerate(annotations):
-                        message_content.value = message_content.value.replace(annotation.text, f"[{i}]")
-                        if file_citation := getattr(annotation, "file_citation", None):
-                            file_ = await self.client.files.retrieve(file_citation.file_id)
-                            citations.append(f"[{i}]: {file_.filename}")
+    @staticmethod
+    async def _with_default(coro, default):
+        try:
+            return await coro
+        except Exception as e:
+            logging.exception(e)
+            return default
 
-                    n_input_tokens, n_output_tokens = run.usage.prompt_tokens, run.usage.completion_tokens
+    @staticmethod
+    def _merge_partner_answer(answer: str, answer_partner: Optional[str]) -> str:
+        if not answer_partner or not answer_partner.strip():
+            return answer
+        return f"{answer.rstrip()}\n\n🤝 Предложения партнёров:\n{answer_partner.strip()}"
 
+    async def partner_answer_assistant(self, message: str,
+                                       media_content: Optional[list] = None):
+        partner_vs = await db.get_all_partners()
 
-            except Exception as e:
-                logging.exception(e)
-                raise Exception(f"⚠️ _'error'._ ⚠️\n{str(e)}") from e
+        if partner_vs == []:
+            return None, 0, 0
+
+        message = (message or "") + self.partner_extend_prompt
+
+        messages = self._generate_prompt_messages_assistant(message=message,
+                                                            media_content=media_content)
+        thread = await self.client.beta.threads.create(tool_resources={
+            "file_search": {"vector_store_ids": partner_vs}},
+            messages=messages)
+
+        result = await self.run_executor.run(thread_id=thread.id,
+                                             assistant_id=self.assistant_id)
+        answer, citations = await self._format_citations(result)
+
+        citation = '\n'.join(citations)
+        return f"{answer}\n{citation}", result.n_input_tokens, result.n_output_tokens
+
+    async def _get_dialog_thread(self, messages: list, vs_ids: list,
+                                 user_id: Optional[int] = None,
+                                 dialog_id: Optional[str] = None):
+        tool_resources = {"file_search": {"vector_store_ids": vs_ids}}
+
+        if dialog_id is not None:
+            thread_id, thread_vs_ids = await db.get_dialog_thread(user_id, dialog_id)
+
+            if thread_id is not None:
+                try:
+                    if sorted(thread_vs_ids) != sorted(vs_ids):
+                        await self.client.beta.threads.update(thread_id, tool_resources=tool_resources)
+                        await db.set_dialog_thread(user_id, dialog_id, thread_id, vs_ids)
+
+                    await self.client.beta.threads.messages.create(thread_id=thread_id,
+                                                                   role="user",
+                                                                   content=messages[-1]["content"])
+                    return thread_id
+
+                except (openai.NotFoundError, openai.BadRequestError) as e:
+                    logging.warning(f"Thread {thread_id} of dialog {dialog_id} is rebuilt: {e}")
+
+        thread = await self.client.beta.threads.create(tool_resources=tool_resources,
+                                                       messages=messages)
+        if dialog_id is not None:
+            await db.set_dialog_thread(user_id, dialog_id, thread.id, vs_ids)
+
+        return thread.id
+
+    async def _main_answer_assistant(self, message,
+                                     dialog_messages: List,
+                                     media_content: list,
+                                     on_delta: Optional[Callable[[str], Awaitable]] = None,
+                                     user_id: Optional[int] = None,
+                                     dialog_id: Optional[str] = None,
+                                     model: str = "gpt-4o",
+                                     vs_ids: Optional[list] = None):
+        if vs_ids is None:
+            vs_ids = await db.get_all_vs()
+
+        context_window = ContextWindow(model)
+        dialog_messages, n_first_dialog_messages_removed = context_window.fit(
+            dialog_messages,
+            reserved_tokens=context_window.count_message(message)
+        )
 
-            else:
-                citation = '\n'.join(citations)
-                return f"{answer}\n{citation}", n_input_tokens, n_output_tokens, is_voice
+        messages = self._generate_prompt_messages_assistant(message,
+                                                            dialog_messages,
+                                                            media_content)
+        thread_id = await self._get_dialog_thread(messages, vs_ids,
+                                                  user_id=user_id,
+                                                  dialog_id=dialog_id)
+
+        # a reused thread still holds the dropped turns, the run only sees the kept ones and the new message
+        truncation_strategy = {"type": "last_messages", "last_messages": 2 * len(dialog_messages) + 1}
+        result = await self.run_executor.run(thread_id=thread_id,
+                                             assistant_id=self.assistant_id,
+                                             on_delta=on_delta,
+                                             truncation_strategy=truncation_strategy)
+        answer, citations = await self._format_citations(result)
+
+        citation = '\n'.join(citations)
+        return f"{answer}\n\n{citation}", result.n_input_tokens, result.n_output_tokens, \
+               n_first_dialog_messages_removed
 
     async def send_message_assistant(self, message,
                                      dialog_messages: List = [],
                                      image_buffer: io.BytesIO = None,
-                                     video_buffer: io.BytesIO = None):
-        vs_ids = await db.get_all_vs()
-        n_dialog_messages_before = len(dialog_messages)
-        answer = None
-
-        while answer is None:
-            try:
-                #is_voice = await self.is_need_voice(message)
-                answer_partner, n_input_tokens_p, n_output_tokens_p, is_voice = await self.partner_answer_assistant(
-                    message=message,
-                    image_buffer=image_buffer,
-                    video_buffer=video_buffer
-                )
-
-                messages = await self._generate_prompt_messages_assistant(message,
-                                                                          dialog_messages,
-                                                                          image_buffer,
-                                                                          video_buffer)
-                thread = await self.client.beta.threads.create(tool_resources={
-                    "file_search": {"vector_store_ids": vs_ids}},
-                    messages=messages)
-
-                run = await self.client.beta.threads.runs.create_and_poll(thread_id=thread.id,
-                                                                          assistant_id=self.assistant_id)
-
-                async def _wait_on_run(_run, _thread):
-
-                    while _run.status in ["queued", "in_progress"]:
-                        _run = await self.client.beta.threads.runs.retrieve(
-                            thread_id=_thread.id,
-                            run_id=_run.id
-                        )
-                        await asyncio.sleep(0.5)
-                    return _run
-
-                run = await _wait_on_run(run, thread)
-
-                if run.status == "completed":
-                    messages = list(await self.client.beta.threads.messages.list(
-                        thread_id=thread.id,
-                        run_id=run.id
-                    ))
-                    # print(messages)
-                    message_content = messages[0][1][0].content[0].text
-                    annotations = message_content.annotations
-                    citations = []
-
-                    for i, annotation in enumerate(annotations):
-                        message_content.value = message_content.value.replace(annotation.text, f"[{i}]")
-                        if file_citation := getattr(annotation, "file_citation", None):
-                            file_ = await self.client.files.retrieve(file_citation.file_id)
-                            citations.append(f"[{i}]: {file_.filename}")
-                    answer = message_content.value
-                    n_input_tokens, n_output_tokens = run.usage.prompt_tokens, run.usage.completion_tokens
-                    n_first_dialog_messages_removed = n_dialog_messages_before - len(dialog_messages)
-
-                elif run.status == "requires_action":
-                    tool_call = run.required_action.submit_tool_outputs.tool_calls[0]
-                    func_name = tool_call.function.name
-                    arg = json.loads(tool_call.function.arguments)
-                    function = self.tools_dict[func_name]
-                    context = await function(**arg)
-
-                    run = await self.client.beta.threads.runs.submit_tool_outputs(
-                        thread_id=thread.id,
-                        run_id=run.id,
-                        tool_outputs=[
-                            {
-                                "tool_call_id": tool_call.id,
-                                "output": json.dumps(context)
-                            }
-                        ]
-                    )
-
-                    run = await _wait_on_run(run, thread)
-
-                    messages = list(await self.client.beta.threads.messages.list(
-                        thread_id=thread.id,
-                        run_id=run.id
-                    ))
-                    message_content = messages[0][1][0].content[0].text
-                    annotations = message_content.annotations
-                    citations = []
-
-                    for i, annotation in enumerate(annotations):
-                        message_content.value = message_content.value.replace(annotation.text, f"[{i}]")
-                        if file_citation := getattr(annotation, "file_citation", None):
-                            file_ = await self.client.files.retrieve(file_citation.file_id)
-                            citations.append(f"[{i}]: {file_.filename}")
-                    answer = message_content.value
-                    n_input_tokens, n_output_tokens = run.usage.prompt_tokens, run.usage.completion_tokens
-                    n_first_dialog_messages_removed = n_dialog_messages_before - len(dialog_messages)
-
-            except Exception as e:
-                logging.exception(e)
-                raise Exception(f"⚠️ _'error'._ ⚠️\n{str(e)}") from e
-
-            else:
-                citation = '\n'.join(citations)
-                return f"{answer}\n\n{citation}", (n_input_tokens+n_input_tokens_p, n_output_tokens+n_output_tokens_p), \
-                       n_first_dialog_messages_removed, is_voice
+                                     video_buffer: io.BytesIO = None,
+                                     on_delta: Optional[Callable[[str], Awaitable]] = None,
+                                     user_id: Optional[int] = None,
+                                     dialog_id: Optional[str] = None,
+                                     model: str = "gpt-4o"):
+        tasks = []
+
+        try:
+            vs_ids = await db.get_all_vs()
+
+            use_cache = Answers.is_cacheable(message, dialog_messages, image_buffer, video_buffer)
+            if use_cache and (answer := await Answers.get(message, vs_ids)) is not None:
+                is_voice = await self._with_default(self.is_need_voice(message), False)
+                if dialog_id is not None:
+                    # the thread does not contain the cached turn, the next turn rebuilds it from history
+                    await db.set_dialog_thread(user_id, dialog_id, None)
+                return answer, (0, 0), 0, is_voice
+
+            # partner lookup and voice intent only enrich the answer, so their failures must not fail it;
+            # the voice classifier starts first to overlap media preparation
+            tasks = [asyncio.create_task(self._with_default(self.is_need_voice(message), False))]
+
+            if on_delta is not None:
+                on_delta = self._stream_unless_voice(on_delta, tasks[0])
+
+            media_content = await self._prepare_media(image_buffer, video_buffer)
+
+            tasks += [
+                asyncio.create_task(self._with_default(self.partner_answer_assistant(message, media_content),
+                                                       (None, 0, 0))),
+                asyncio.create_task(self._main_answer_assistant(message, dialog_messages, media_content, on_delta,
+                                                                user_id=user_id,
+                                                                dialog_id=dialog_id,
+                                                                model=model,
+                                                                vs_ids=vs_ids))
+            ]
+            is_voice, (answer_partner, n_input_tokens_p, n_output_tokens_p), \
+                (answer, n_input_tokens, n_output_tokens, n_first_dialog_messages_removed) = await asyncio.gather(*tasks)
+
+            answer = self._merge_partner_answer(answer, answer_partner)
+
+            if use_cache:
+                await Answers.set(message, vs_ids, answer)
+
+        except Exception as e:
+            logging.exception(e)
+            raise Exception(f"⚠️ _'error'._ ⚠️\n{str(e)}") from e
+
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        return answer, (n_input_tokens + n_input_tokens_p, n_output_tokens + n_output_tokens_p), \
+               n_first_dialog_messages_removed, is_voice
 
     @staticmethod
     def _count_tokens_from_messages(messages, answer, model="gpt-4o"):
-        encoding = tiktoken.encoding_for_model(model)
-
-        if model == "gpt-3.5-turbo-16k":
-            tokens_per_message = 4
-            tokens_per_name = -1
-        elif model == "gpt-3.5-turbo":
-            tokens_per_message = 4
-            tokens_per_name = -1
-        elif model == "gpt-4":
-            tokens_per_message = 3
-            tokens_per_name = 1
-        elif model == "gpt-4-1106-preview":
-            tokens_per_message = 3
-            tokens_per_name = 1
-        elif model == "gpt-4-vision-preview":
-            tokens_per_message = 3
-            tokens_per_name = 1
-        elif model == "gpt-4-turbo":
-            tokens_per_message = 3
-            tokens_per_name = 1
-        elif model == "gpt-4o":
-            tokens_per_message = 3
-            tokens_per_name = 1
-        else:
-            raise ValueError(f"Unknown model: {model}")
-
-        # input
-        n_input_tokens = 0
-        for message in messages:
-            n_input_tokens += tokens_per_message
-            if isinstance(message["content"], list):
-                for sub_message in message["content"]:
-                    if "type" in sub_message:
-                        if sub_message["type"] == "text":
-                            n_input_tokens += len(encoding.encode(sub_message["text"]))
-                        elif sub_message["type"] == "image_url":
-                            pass
-            else:
-                if "type" in message:
-                    if message["type"] == "text":
-                        n_input_tokens += len(encoding.encode(message["text"]))
-                    elif message["type"] == "image_url":
-                        pass
-
-        n_input_tokens += 2
-
-        # output
-        n_output_tokens = 1 + len(encoding.encode(answer))
-
-        return n_input_tokens, n_output_tokens
+        return count_dialog_tokens(messages, answer, model)
@@ -0,0 +1,136 @@
+from typing import Callable, Awaitable, Dict, List, Optional
+import asyncio
+import json
+import logging
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled", "expired", "incomplete")
+# run-level events only: thread.run.step.* events carry step objects with their own ids and statuses
+RUN_EVENTS = {
+    "thread.run.created", "thread.run.queued", "thread.run.in_progress", "thread.run.requires_action",
+    "thread.run.completed", "thread.run.incomplete", "thread.run.failed", "thread.run.cancelling",
+    "thread.run.cancelled", "thread.run.expired"
+}
+
+
+class RunError(Exception):
+    pass
+
+
+class RunResult:
+    def __init__(self):
+        self.run_id = None
+        self.status = None
+        self.text = ""
+        self.annotations = []
+        self.n_input_tokens = 0
+        self.n_output_tokens = 0
+
+
+class RunExecutor:
+    def __init__(self, runs, tools: Optional[Dict[str, Callable[..., Awaitable]]] = None):
+        # runs is client.beta.threads.runs or anything with the same create/submit_tool_outputs
+        self.runs = runs
+        self.tools = tools or {}
+
+    async def _call_tools(self, tool_calls) -> List[dict]:
+        tool_outputs = []
+        for tool_call in tool_calls:
+            function = self.tools[tool_call.function.name]
+            arg = json.loads(tool_call.function.arguments)
+            context = await function(**arg)
+            tool_outputs.append({
+                "tool_call_id": tool_call.id,
+                "output": json.dumps(context)
+            })
+        return tool_outputs
+
+    async def run(self, thread_id: str, assistant_id: str,
+                  on_delta: Optional[Callable[[str], Awaitable]] = None,
+                  **run_kwargs) -> RunResult:
+        result = RunResult()
+        text_parts = []
+
+        try:
+            await self._consume(thread_id, assistant_id, result, text_parts, on_delta, **run_kwargs)
+        except asyncio.CancelledError:
+            # an active run locks its thread, so a reused thread would refuse the next message
+            if result.run_id is not None and result.status not in TERMINAL_STATUSES:
+                try:
+                    await self.runs.cancel(thread_id=thread_id, run_id=result.run_id)
+                except Exception as e:
+                    logging.warning(f"Run {result.run_id} not cancelled: {e}")
+            raise
+
+        if not result.text:
+            result.text = "".join(text_parts)
+
+        logging.info(f"Run {result.run_id} finished with status {result.status}")
+        return result
+
+    async def _consume(self, thread_id: str, assistant_id: str, result: RunResult, text_parts: List[str],
+                       on_delta: Optional[Callable[[str], Awaitable]] = None,
+                       **run_kwargs):
+        stream = await self.runs.create(thread_id=thread_id,
+                                        assistant_id=assistant_id,
+                                        stream=True,
+                                        **run_kwargs)
+        while stream is not None:
+            next_stream = None
+
+            async for event in stream:
+                if event.event == "thread.message.delta":
+                    for content in event.data.delta.content or []:
+                        if content.type != "text" or content.text is None or not content.text.value:
+                            continue
+                        text_parts.append(content.text.value)
+                        if on_delta is not None:
+                            await on_delta(content.text.value)
+
+                elif event.event == "thread.message.completed":
+                    for content in event.data.content:
+                        if content.type == "text":
+                            result.text = content.text.value
+                            result.annotations = list(content.text.annotations or [])
+
+                elif event.event == "thread.run.requires_action":
+                    run = event.data
+                    result.run_id = run.id
+                    tool_outputs = await self._call_tools(run.required_action.submit_tool_outputs.tool_calls)
+                    next_stream = await self.runs.submit_tool_outputs(thread_id=thread_id,
+                                                                      run_id=run.id,
+                                                                      tool_outputs=tool_outputs,
+                                                                      stream=True)
+
+                elif event.event == "thread.run.completed":
+                    run = event.data
+                    result.run_id = run.id
+                    if run.usage is not None:
+                        result.n_input_tokens = run.usage.prompt_tokens
+                        result.n_output_tokens = run.usage.completion_tokens
+
+                elif event.event == "thread.run.incomplete":
+                    # the run hit a token limit; a partial answer is still an answer
+                    run = event.data
+                    details = getattr(run, "incomplete_details", None)
+                    logging.warning(f"Run {run.id} incomplete: {details.reason if details else ''}")
+                    if getattr(run, "usage", None) is not None:
+                        result.n_input_tokens = run.usage.prompt_tokens
+                        result.n_output_tokens = run.usage.completion_tokens
+                    if not result.text and not text_parts:
+                        raise RunError(f"Run {run.id} incomplete without an answer")
+
+                elif event.event in ("thread.run.failed", "thread.run.cancelled", "thread.run.expired"):
+                    run = event.data
+                    error = getattr(run, "last_error", None)
+                    raise RunError(f"Run {run.id} {run.status}: {error.message if error else ''}")
+
+                elif event.event == "error":
+                    raise RunError(str(event.data))
+
+                if event.event in RUN_EVENTS:
+                    # a cancel on CancelledError must target the run, not one of its steps
+                    result.run_id = event.data.id
+                    result.status = event.data.status
+
+            stream = next_stream
+
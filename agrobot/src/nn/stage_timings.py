@@ -0,0 +1,34 @@
+from collections import defaultdict, deque
+from typing import Awaitable
+import time
+
+
+class StageTimings:
+    def __init__(self, window: int = 200):
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+
+    def add(self, stage: str, seconds: float):
+        self.samples[stage].append(seconds)
+
+    async def timed(self, stage: str, awaitable: Awaitable):
+        started = time.monotonic()
+        try:
+            return await awaitable
+        finally:
+            self.add(stage, time.monotonic() - started)
+
+    def report(self):
+        report = {}
+        for stage, samples in self.samples.items():
+            samples = sorted(samples)
+            if not samples:
+                continue
+            report[stage] = {
+                "n": len(samples),
+                "avg_ms": 1000 * sum(samples) / len(samples),
+                "p95_ms": 1000 * samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+            }
+        return report
+
+
+VideoTimings = StageTimings()
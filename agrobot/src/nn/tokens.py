@@ -0,0 +1,89 @@
+from functools import lru_cache
+from typing import List
+
+import tiktoken
+
+DEFAULT_ENCODING = "o200k_base"
+
+# longest prefix wins, so dated snapshots (gpt-4o-2024-05-13, ...) resolve to their family
+MODEL_ENCODINGS = {
+    "gpt-4o": "o200k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-3.5-turbo": "cl100k_base",
+    "text-embedding-3": "cl100k_base",
+    "text-embedding-ada-002": "cl100k_base",
+}
+
+# model: (tokens_per_message, tokens_per_name)
+MODEL_OVERHEAD = {
+    "gpt-4o": (3, 1),
+    "gpt-4": (3, 1),
+    "gpt-3.5-turbo": (4, -1),
+}
+DEFAULT_OVERHEAD = (3, 1)
+REPLY_PRIMING_TOKENS = 2
+
+
+def _lookup(table: dict, model: str, default):
+    for prefix in sorted(table, key=len, reverse=True):
+        if model.startswith(prefix):
+            return table[prefix]
+    return default
+
+
+@lru_cache(maxsize=None)
+def _load_encoding(name: str):
+    return tiktoken.get_encoding(name)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    return _load_encoding(_lookup(MODEL_ENCODINGS, model or "", DEFAULT_ENCODING))
+
+
+def get_overhead(model: str):
+    return _lookup(MODEL_OVERHEAD, model or "", DEFAULT_OVERHEAD)
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    return len(get_encoding(model).encode(text or "", disallowed_special=()))
+
+
+def count_tokens_batch(texts: List[str], model: str = "gpt-4o") -> List[int]:
+    if not texts:
+        return []
+    encoded = get_encoding(model).encode_batch([text or "" for text in texts], disallowed_special=())
+    return [len(tokens) for tokens in encoded]
+
+
+def _content_texts(content) -> List[str]:
+    if content is None:
+        return []
+    if isinstance(content, str):
+        return [content]
+    # image parts are billed by the API separately and are not counted here
+    return [part["text"] for part in content if isinstance(part, dict) and part.get("type") == "text"]
+
+
+def count_message_tokens(messages: List[dict], model: str = "gpt-4o") -> int:
+    tokens_per_message, tokens_per_name = get_overhead(model)
+
+    texts = []
+    n_tokens = REPLY_PRIMING_TOKENS
+    for message in messages:
+        n_tokens += tokens_per_message
+        texts.extend(_content_texts(message.get("content")))
+        if "name" in message:
+            n_tokens += tokens_per_name
+            texts.append(message["name"])
+
+    return n_tokens + sum(count_tokens_batch(texts, model))
+
+
+def count_prompt_tokens(prompt: str, answer: str, model: str = "gpt-4o"):
+    n_input_tokens, n_output_tokens = count_tokens_batch([prompt, answer], model)
+    return n_input_tokens + 1, n_output_tokens
+
+
+def count_dialog_tokens(messages: List[dict], answer: str, model: str = "gpt-4o"):
+    return count_message_tokens(messages, model), 1 + count_tokens(answer, model)
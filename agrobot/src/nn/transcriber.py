@@ -0,0 +1,87 @@
+from typing import List, Tuple
+import asyncio
+import logging
+
+from src.config import Config
+from src.nn.audio_extract import extract_audio, detect_silences
+
+WHISPER_MAX_BYTES = 25 * 1024 * 1024
+
+
+def _bitrate_bps(bitrate: str) -> int:
+    bitrate = bitrate.strip().lower()
+    if bitrate.endswith("k"):
+        return int(float(bitrate[:-1]) * 1000)
+    return int(bitrate)
+
+
+def _timestamp(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def plan_chunks(duration: float, silences: List[float], max_seconds: float,
+                min_seconds: float = 0.0) -> List[Tuple[float, float]]:
+    # cut at the latest silence that keeps the chunk within max_seconds, hard cut if there is none
+    chunks = []
+    start = 0.0
+    while duration - start > max_seconds:
+        cuts = [point for point in silences if start + min_seconds < point <= start + max_seconds]
+        end = cuts[-1] if cuts else start + max_seconds
+        chunks.append((start, end))
+        start = end
+    if duration > start or not chunks:
+        chunks.append((start, duration))
+    return chunks
+
+
+class ChunkedTranscriber:
+    def __init__(self, client, prompt: str = "",
+                 chunk_seconds: float = Config.transcribe_chunk_seconds,
+                 concurrency: int = Config.transcribe_concurrency,
+                 retries: int = Config.transcribe_retries,
+                 bitrate: str = Config.audio_bitrate):
+        # retries are per chunk here, SDK retries on top would multiply the time to fail
+        self.client = client.with_options(max_retries=0)
+        self.prompt = prompt
+        self.bitrate = bitrate
+        self.concurrency = concurrency
+        self.retries = retries
+        # stay under the Whisper upload limit with headroom for VBR overshoot and the container
+        self.chunk_seconds = min(chunk_seconds, 0.8 * WHISPER_MAX_BYTES * 8 / _bitrate_bps(bitrate))
+
+    async def _transcribe_chunk(self, video_path: str, start: float, end: float,
+                                semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            audio = await extract_audio(video_path, self.bitrate, start=start, duration=end - start)
+
+            for attempt in range(self.retries + 1):
+                try:
+                    result = await self.client.audio.transcriptions.create(model="whisper-1",
+                                                                           file=(audio.name, audio.getvalue()),
+                                                                           prompt=self.prompt)
+                    return result.text
+                except Exception as e:
+                    if attempt == self.retries:
+                        raise
+                    logging.warning(f"Chunk {_timestamp(start)}-{_timestamp(end)} failed "
+                                    f"(attempt {attempt + 1}): {e}")
+                    await asyncio.sleep(2 ** attempt)
+
+    async def transcribe(self, video_path: str) -> str:
+        duration, silences = await detect_silences(video_path)
+        chunks = plan_chunks(duration, silences, self.chunk_seconds, min_seconds=self.chunk_seconds / 4)
+        logging.info(f"Transcribing {duration:.0f}s of audio in {len(chunks)} chunks")
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = [asyncio.create_task(self._transcribe_chunk(video_path, start, end, semaphore))
+                 for start, end in chunks]
+        try:
+            texts = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        return "\n\n".join(f"[{_timestamp(start)}] {text.strip()}"
+                           for (start, _), text in zip(chunks, texts) if text.strip())
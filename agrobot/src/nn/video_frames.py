@@ -0,0 +1,136 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+import asyncio
+import base64
+import heapq
+import logging
+import multiprocessing
+
+import cv2
+
+from src.config import Config
+
+# "low" detail images are billed as a single 512px tile, anything larger is wasted bandwidth
+LOW_DETAIL_SIZE = 512
+
+
+def _downscale(frame, max_side: int):
+    height, width = frame.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return frame
+    return cv2.resize(frame, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+def _histogram(frame):
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, [32, 32], [0, 180, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+def keep_keyframe(heap: list, score: float, index: int, frame, max_frames: int):
+    # min-heap of the strongest scene changes seen so far, memory stays at max_frames frames;
+    # on equal scores the earlier frame wins
+    item = (score, -index, frame)
+    if max_frames <= 0 or len(heap) < max_frames:
+        heapq.heappush(heap, item)
+    elif item[:2] > heap[0][:2]:
+        heapq.heapreplace(heap, item)
+
+
+class SampledFrames:
+    def __init__(self, frames: List[bytes], n_sampled: int):
+        self.frames = frames
+        self.n_sampled = n_sampled
+
+    @property
+    def n_kept(self) -> int:
+        return len(self.frames)
+
+    @property
+    def n_dropped(self) -> int:
+        return self.n_sampled - self.n_kept
+
+
+def sample_frames(path: str, seconds_per_frame: float = 1.0,
+                  max_side: int = LOW_DETAIL_SIZE, jpeg_quality: int = 80,
+                  max_frames: int = 0, scene_threshold: float = 0.0) -> SampledFrames:
+    # runs in a worker process; decodes forward only, skipped frames are grab()-ed without a re-seek
+    video = cv2.VideoCapture(path)
+    try:
+        fps = video.get(cv2.CAP_PROP_FPS) or 25
+        step = max(1, int(round(fps * seconds_per_frame)))
+
+        keyframes = []
+        last_hist = None
+        n_sampled = 0
+        index = 0
+        while video.grab():
+            if index % step == 0:
+                success, frame = video.retrieve()
+                if not success:
+                    break
+                n_sampled += 1
+
+                frame = _downscale(frame, max_side)
+                hist = _histogram(frame)
+                # Bhattacharyya distance to the last kept frame: 0 for the same scene, 1 for a full cut
+                score = 1.0 if last_hist is None else cv2.compareHist(last_hist, hist, cv2.HISTCMP_BHATTACHARYYA)
+                if score >= scene_threshold:
+                    keep_keyframe(keyframes, score, n_sampled, frame, max_frames)
+                    last_hist = hist
+            index += 1
+    finally:
+        video.release()
+
+    frames = []
+    for _, _, frame in sorted(keyframes, key=lambda item: -item[1]):
+        success, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+        if success:
+            frames.append(buffer.tobytes())
+    return SampledFrames(frames, n_sampled)
+
+
+def frame_to_data_url(frame: bytes) -> str:
+    return f"data:image/jpeg;base64,{base64.b64encode(frame).decode('utf-8')}"
+
+
+class FrameSampler:
+    def __init__(self, workers: int = Config.video_frame_workers,
+                 max_side: int = Config.video_frame_max_side,
+                 jpeg_quality: int = Config.video_frame_jpeg_quality,
+                 max_frames: int = Config.video_max_frames,
+                 scene_threshold: float = Config.video_scene_threshold):
+        self.workers = workers
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.max_frames = max_frames
+        self.scene_threshold = scene_threshold
+        self.n_kept = 0
+        self.n_dropped = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # the bot already runs driver and executor threads by now, a forked worker could inherit a held lock
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("forkserver"))
+        return self._pool
+
+    async def sample(self, path: str, seconds_per_frame: float = 1.0) -> SampledFrames:
+        sampled = await asyncio.get_running_loop().run_in_executor(self.pool, sample_frames, path, seconds_per_frame,
+                                                                   self.max_side, self.jpeg_quality,
+                                                                   self.max_frames, self.scene_threshold)
+        self.n_kept += sampled.n_kept
+        self.n_dropped += sampled.n_dropped
+        logging.info(f"Video keyframes: kept {sampled.n_kept} of {sampled.n_sampled}, dropped {sampled.n_dropped}")
+        return sampled
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+Frames = FrameSampler()
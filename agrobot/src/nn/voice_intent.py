@@ -0,0 +1,73 @@
+from typing import Optional, Tuple
+import json
+import logging
+import math
+import re
+
+WORD_RE = re.compile(r"[a-zа-яё]+")
+
+# stems cover the inflected forms: голосом, голосовое, озвучь, озвучить, озвучка...
+VOICE_STRONG = [
+    r"голосом", r"голосов(ое|ым|ой|ую|ых|ом)", r"голосовуха", r"войс",
+    r"озвуч\w*", r"вслух", r"аудио\s*(ответ|сообщени\w*|формат\w*)",
+    r"(ответ|скаж|расскаж|объясн|прочита|продиктуй|произнес)\w*\s+(мне\s+)?(голосом|вслух|аудио)",
+]
+VOICE_WEAK = [r"голос\w*", r"аудио\w*", r"послуша\w*", r"слушать", r"произнес\w*", r"произнош\w*"]
+TEXT_PREFERENCE = [r"текстом", r"текстов(ое|ым|ый)", r"письменно", r"только\s+текст\w*"]
+# a negation up to two words before the voice word: "не отвечай голосом", "без озвучки", "не надо мне аудио"
+VOICE_NEGATION = [r"(не|без|нельзя)\s+(\w+\s+){0,2}(голос\w*|озвуч\w*|аудио\w*|вслух|войс\w*)"]
+
+VOICE_STRONG_RE = re.compile(r"\b(" + "|".join(VOICE_STRONG) + r")\b")
+VOICE_WEAK_RE = re.compile(r"\b(" + "|".join(VOICE_WEAK) + r")\b")
+TEXT_PREFERENCE_RE = re.compile(r"\b(" + "|".join(TEXT_PREFERENCE + VOICE_NEGATION) + r")\b")
+
+
+class VoiceIntentDetector:
+    def __init__(self, model_path: Optional[str] = None):
+        self.bias = 0.0
+        self.weights = {}
+
+        if model_path:
+            self.load_model(model_path)
+
+    @property
+    def has_model(self):
+        return bool(self.weights)
+
+    def load_model(self, model_path: str):
+        # {"bias": float, "weights": {"token": float}} - logistic regression over lowercased tokens
+        try:
+            with open(model_path, "r") as f:
+                model = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Voice intent model {model_path} not loaded: {e}")
+            return
+
+        self.bias = float(model.get("bias", 0.0))
+        self.weights = {token: float(weight) for token, weight in model.get("weights", {}).items()}
+
+    def _model_probability(self, text: str):
+        score = self.bias + sum(self.weights.get(token, 0.0) for token in WORD_RE.findall(text))
+        return 1 / (1 + math.exp(-score))
+
+    def __call__(self, message: Optional[str]) -> Tuple[bool, float]:
+        if not message:
+            return False, 1.0
+
+        text = message.lower()
+
+        if TEXT_PREFERENCE_RE.search(text):
+            return False, 0.9
+
+        if VOICE_STRONG_RE.search(text):
+            return True, 0.95
+
+        if not VOICE_WEAK_RE.search(text):
+            return False, 0.95
+
+        # "голос"/"аудио" without a request form: could be about the topic itself
+        if self.has_model:
+            probability = self._model_probability(text)
+            return probability >= 0.5, max(probability, 1 - probability)
+
+        return False, 0.5
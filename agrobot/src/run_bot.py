@@ -1,7 +1,12 @@
 import asyncio
 
 from src.handlers import admin, user
+from src.handlers.admin import knowledge_loader
 from src.bot import bot
+from src.database import DataBase as db
+from src.http_client import HttpClients
+from src.nn.video_frames import Frames
+from src.utils import Broadcast
 
 from aiogram.fsm.strategy import FSMStrategy
 from aiogram import Dispatcher
@@ -23,11 +28,27 @@ async def starting_bot():
 
     logger.info("Starting bot")
 
+    await db.ensure_indexes()
+    await db.load_admin_cache()
+    await db.load_rate_cache()
+
+    background_tasks = [asyncio.create_task(db.run_renewal_worker()),
+                        asyncio.create_task(db.run_renewal_sweeper()),
+                        asyncio.create_task(knowledge_loader.sync_file_names())]
+
     dp: Dispatcher = Dispatcher(fsm_strategy=FSMStrategy.USER_IN_CHAT)
 
     dp.include_routers(admin, user)
 
-    await dp.start_polling(bot)
+    await Broadcast.resume(bot)
+
+    try:
+        await dp.start_polling(bot)
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await HttpClients.close()
+        Frames.close()
 
 
 if __name__ == "__main__":
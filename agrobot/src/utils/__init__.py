@@ -7,10 +7,13 @@
 from .messages import *
 from .general import get_rate_data, is_previous_message_not_answered_yet
 from .stats import Statistics
+from .broadcast import Broadcaster
+from .stream_renderer import StreamRenderer
 
 from .admin_utils import *
 from .user_utils import *
 from .phone_utils import *
 
 Stats = Statistics()
+Broadcast = Broadcaster()
 
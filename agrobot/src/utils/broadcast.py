@@ -0,0 +1,203 @@
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+from src.database import DataBase as db
+from src.config import Config
+
+import asyncio
+import logging
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Broadcaster:
+    def __init__(self,
+                 rate: float = Config.broadcast_rate,
+                 chat_interval: float = Config.broadcast_chat_interval,
+                 concurrency: int = Config.broadcast_concurrency,
+                 batch_size: int = Config.broadcast_batch_size,
+                 progress_interval: float = Config.broadcast_progress_interval,
+                 max_retries: int = 3):
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.max_retries = max_retries
+
+        self.chat_last_sent = {}
+        self.tasks = {}
+        self.admins = {}
+        self.cancelled = set()
+
+    async def create_campaign(self, admin_id: int, from_chat_id: int, message_id: int,
+                              status_chat_id: int, status_message_id: int):
+        return await db.add_new_campaign(admin_id=admin_id,
+                                         from_chat_id=from_chat_id,
+                                         message_id=message_id,
+                                         status_chat_id=status_chat_id,
+                                         status_message_id=status_message_id)
+
+    async def _wait_chat(self, chat_id: int):
+        last_sent = self.chat_last_sent.get(chat_id)
+        if last_sent is not None:
+            delay = last_sent + self.chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def _prune_chat_last_sent(self):
+        threshold = time.monotonic() - self.chat_interval
+        self.chat_last_sent = {chat_id: last_sent for chat_id, last_sent in self.chat_last_sent.items()
+                               if last_sent > threshold}
+
+    async def _send(self, bot: Bot, campaign: dict, chat_id: int, semaphore: asyncio.Semaphore):
+        result = await self._deliver(bot, campaign, chat_id, semaphore)
+        await db.mark_campaign_sent(campaign["_id"], chat_id, result)
+        campaign[f"n_{result}"] += 1
+        return result
+
+    async def _deliver(self, bot: Bot, campaign: dict, chat_id: int, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            for _ in range(self.max_retries + 1):
+                await self._wait_chat(chat_id)
+                await self.bucket.acquire()
+                self.chat_last_sent[chat_id] = time.monotonic()
+
+                try:
+                    await bot.copy_message(chat_id=chat_id,
+                                           from_chat_id=campaign["from_chat_id"],
+                                           message_id=campaign["message_id"])
+                except TelegramRetryAfter as e:
+                    self.bucket.pause(e.retry_after)
+                except TelegramForbiddenError:
+                    return "blocked"
+                except TelegramBadRequest as e:
+                    logging.warning(f"Broadcast to {chat_id} failed: {e}")
+                    return "failed"
+                except Exception as e:
+                    logging.exception(e)
+                    return "failed"
+                else:
+                    return "delivered"
+            self.chat_last_sent.pop(chat_id, None)
+            return "failed"
+
+    @staticmethod
+    def progress_text(campaign: dict, state: str = "running"):
+        n_done = campaign["n_delivered"] + campaign["n_blocked"] + campaign["n_failed"]
+        title = {
+            "finished": "✅ Рассылка завершена",
+            "cancelled": "🛑 Рассылка отменена"
+        }.get(state, "⏳ Идёт рассылка...")
+        return (
+            f"<b>{title}</b>\n\n"
+            f"📩 <b>Обработано:</b> <code>{n_done}/{campaign['n_total']}</code>\n"
+            f"✅ <b>Доставлено:</b> <code>{campaign['n_delivered']}</code>\n"
+            f"🚫 <b>Заблокировали бота:</b> <code>{campaign['n_blocked']}</code>\n"
+            f"❌ <b>Ошибки:</b> <code>{campaign['n_failed']}</code>"
+        )
+
+    async def _edit_progress(self, bot: Bot, campaign: dict, state: str = "running"):
+        try:
+            await bot.edit_message_text(text=self.progress_text(campaign, state),
+                                        chat_id=campaign["status_chat_id"],
+                                        message_id=campaign["status_message_id"],
+                                        parse_mode="HTML")
+        except TelegramBadRequest:
+            pass
+
+    async def run(self, bot: Bot, campaign_id: str):
+        campaign = await db.get_campaign(campaign_id)
+        self.admins[campaign_id] = campaign["admin_id"]
+        already_sent = set(campaign.get("batch_sent", []))
+        semaphore = asyncio.Semaphore(self.concurrency)
+        last_progress = time.monotonic()
+
+        async def _process(user_ids):
+            nonlocal last_progress
+
+            await asyncio.gather(*[self._send(bot, campaign, int(user_id), semaphore)
+                                   for user_id in user_ids if int(user_id) not in already_sent])
+            await db.update_campaign_progress(campaign_id, cursor_id=user_ids[-1])
+            campaign["cursor"] = user_ids[-1]
+            already_sent.clear()
+            self._prune_chat_last_sent()
+
+            if time.monotonic() - last_progress >= self.progress_interval:
+                await self._edit_progress(bot, campaign)
+                last_progress = time.monotonic()
+
+        try:
+            user_ids = []
+            async for user_id in db.iter_user_ids(after_id=campaign["cursor"],
+                                                  batch_size=self.batch_size):
+                user_ids.append(user_id)
+                if len(user_ids) >= self.batch_size:
+                    await _process(user_ids)
+                    user_ids = []
+
+            if user_ids:
+                await _process(user_ids)
+
+        except asyncio.CancelledError:
+            # only an explicit /cancel ends the campaign; a shutdown leaves it running for resume()
+            if campaign_id in self.cancelled:
+                await db.set_campaign_state(campaign_id, "cancelled")
+                await self._edit_progress(bot, campaign, state="cancelled")
+            raise
+
+        finally:
+            self.admins.pop(campaign_id, None)
+            self.cancelled.discard(campaign_id)
+
+        await db.set_campaign_state(campaign_id, "finished")
+        await self._edit_progress(bot, campaign, state="finished")
+        return campaign
+
+    def start(self, bot: Bot, campaign_id: str) -> asyncio.Task:
+        task = asyncio.create_task(self.run(bot, campaign_id))
+        self.tasks[campaign_id] = task
+        task.add_done_callback(lambda t, c_id=campaign_id: self.tasks.pop(c_id, None))
+        return task
+
+    def cancel(self, admin_id: int) -> bool:
+        campaign_ids = [campaign_id for campaign_id, owner_id in self.admins.items() if owner_id == admin_id]
+        for campaign_id in campaign_ids:
+            self.cancelled.add(campaign_id)
+            task = self.tasks.get(campaign_id)
+            if task is not None:
+                task.cancel()
+        return bool(campaign_ids)
+
+    async def resume(self, bot: Bot):
+        for campaign in await db.get_running_campaigns():
+            self.start(bot, campaign["_id"])
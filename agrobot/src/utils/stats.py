@@ -1,5 +1,9 @@
 from src.database import DataBase as db
 from src.config import Config
+from src.http_client import HttpClients
+from src.nn.answer_cache import Answers
+from src.nn.video_frames import Frames
+from src.nn.stage_timings import VideoTimings
 import matplotlib
 matplotlib.use("AGG")
 import matplotlib.pyplot as plt
@@ -24,8 +28,8 @@ class Statistics:
         if await db.check_if_admin_exists(user_id):
             out_path = f"../stats/plots/{str(datetime.now().date())}"
             await aiofiles.os.makedirs(out_path, exist_ok=True)
-            users_data = await db.get_all_users_data()
-            data_stats = await self.get_stats_for_admin(users_data=users_data,
+            usage_stats = await db.get_usage_stats(top_n=Config.stats_top_n)
+            data_stats = await self.get_stats_for_admin(usage_stats=usage_stats,
                                                         out_path=out_path)
             return data_stats
 
@@ -33,31 +37,10 @@ class Statistics:
 
         return await self.get_user_stats(user_data=user_data)
 
-    async def get_stats_for_admin(self, users_data, out_path: str):
-        data = {
-            "user_id": [],
-            "rate": [],
-            "n_used_tokens": [],
-            "n_transcribed_seconds": [],
-            "n_generate_seconds": [],
-            "n_used_tokens_all": [],
-            "n_transcribed_seconds_all": [],
-            "n_generate_seconds_all": [],
-        }
-
+    async def get_stats_for_admin(self, usage_stats, out_path: str):
         data_point = out_path.split('/')[-1]
+        totals = usage_stats["totals"]
 
-        for user in users_data:
-            data["user_id"].append(user["_id"])
-            data["rate"].append(user["rate"])
-            data["n_used_tokens"].append(user["current_spend"]["month"]["n_used_tokens"])
-            data["n_transcribed_seconds"].append(user["current_spend"]["month"]["n_transcribed_seconds"])
-            data["n_generate_seconds"].append(user["current_spend"]["month"]["n_generate_seconds"])
-            data["n_used_tokens_all"].append(user["current_spend"]["all"]["n_used_tokens"])
-            data["n_transcribed_seconds_all"].append(user["current_spend"]["all"]["n_transcribed_seconds"])
-            data["n_generate_seconds_all"].append(user["current_spend"]["all"]["n_generate_seconds"])
-
-        df = pd.DataFrame(data)
         sns.set_theme(style="whitegrid")
 
         async def save_plot(fig, filename):
@@ -65,8 +48,11 @@ class Statistics:
             await loop.run_in_executor(self.executor, fig.savefig, filename)
             plt.close(fig)
 
+        def top_frame(key):
+            return pd.DataFrame(usage_stats[f"top_{key}"], columns=["_id", key]).rename(columns={"_id": "user_id"})
+
         fig, ax = plt.subplots(figsize=(12, 6))
-        sns.barplot(x="user_id", y="n_used_tokens", data=df, palette="Blues_d", ax=ax)
+        sns.barplot(x="user_id", y="n_used_tokens", data=top_frame("n_used_tokens"), palette="Blues_d", ax=ax)
         ax.set(xlabel='ID Пользователя', ylabel='Использованные Токены (Этот Месяц)',
                title='Ежемесячное Использование Токенов Пользователями')
         plt.xticks(rotation=45)
@@ -75,7 +61,8 @@ class Statistics:
         await save_plot(fig, token_usage_path)
 
         fig, ax = plt.subplots(figsize=(12, 6))
-        sns.barplot(x="user_id", y="n_transcribed_seconds", data=df, palette="Greens_d", ax=ax)
+        sns.barplot(x="user_id", y="n_transcribed_seconds", data=top_frame("n_transcribed_seconds"),
+                    palette="Greens_d", ax=ax)
         ax.set(xlabel='ID Пользователя', ylabel='Секунды на Расшифровку (Этот Месяц)',
                title='Ежемесячное Использование Секунд на Расшифровку Пользователями')
         plt.xticks(rotation=45)
@@ -84,7 +71,8 @@ class Statistics:
         await save_plot(fig, transcribed_seconds_path)
 
         fig, ax = plt.subplots(figsize=(12, 6))
-        sns.barplot(x="user_id", y="n_generate_seconds", data=df, palette="Reds_d", ax=ax)
+        sns.barplot(x="user_id", y="n_generate_seconds", data=top_frame("n_generate_seconds"),
+                    palette="Reds_d", ax=ax)
         ax.set(xlabel='ID Пользователя', ylabel='Секунды на Генерацию (Этот Месяц)',
                title='Ежемесячное Использование Секунд на Генерацию Пользователями')
         plt.xticks(rotation=45)
@@ -93,8 +81,8 @@ class Statistics:
         await save_plot(fig, generate_seconds_path)
 
         fig, ax = plt.subplots(figsize=(12, 6))
-        rate_counts = df["rate"].value_counts()
-        sns.barplot(x=rate_counts.index, y=rate_counts.values, palette="Purples_d", ax=ax)
+        rate_counts = pd.DataFrame(usage_stats["rates"], columns=["_id", "count"])
+        sns.barplot(x="_id", y="count", data=rate_counts, palette="Purples_d", ax=ax)
         ax.set(xlabel='Тип Подписки', ylabel='Количество Пользователей',
                title='Количество Пользователей по Типу Подписки')
         plt.xticks(rotation=0)
@@ -102,17 +90,17 @@ class Statistics:
         subscription_rate_path = os.path.join(out_path, 'subscription_rate.png')
         await save_plot(fig, subscription_rate_path)
 
-        total_users = len(users_data)
-        free_users = len([user for user in users_data if user["rate"] == "free"])
-        premium_users = len(users_data) - free_users
+        total_users = totals["total_users"]
+        free_users = totals["free_users"]
+        premium_users = total_users - free_users
 
-        total_tokens_used = sum(data["n_used_tokens"])
-        total_transcribed_seconds = sum(data["n_transcribed_seconds"])
-        total_generate_seconds = sum(data["n_generate_seconds"])
+        total_tokens_used = totals["n_used_tokens"]
+        total_transcribed_seconds = totals["n_transcribed_seconds"]
+        total_generate_seconds = totals["n_generate_seconds"]
 
-        total_tokens_used_all = sum(data["n_used_tokens_all"])
-        total_transcribed_seconds_all = sum(data["n_transcribed_seconds_all"])
-        total_generate_seconds_all = sum(data["n_generate_seconds_all"])
+        total_tokens_used_all = totals["n_used_tokens_all"]
+        total_transcribed_seconds_all = totals["n_transcribed_seconds_all"]
+        total_generate_seconds_all = totals["n_generate_seconds_all"]
 
         total_cost_tokens = total_tokens_used * Config.TOKEN_COST
         total_cost_transcribe = total_transcribed_seconds * Config.TRANSCRIBE_SECOND_COST
@@ -122,8 +110,8 @@ class Statistics:
         total_cost_transcribe_all = total_transcribed_seconds_all * Config.TRANSCRIBE_SECOND_COST
         total_cost_generate_all = total_generate_seconds_all * Config.GENERATE_SECOND_COST
 
-        total_cost = total_cost_tokens + total_cost_transcribe + total_cost_transcribe
-        total_cost_all = total_cost_tokens_all + total_cost_transcribe_all + total_cost_transcribe_all
+        total_cost = total_cost_tokens + total_cost_transcribe + total_cost_generate
+        total_cost_all = total_cost_tokens_all + total_cost_transcribe_all + total_cost_generate_all
 
         text_stats = (
             f"<b>📊 Общая статистика использования сервиса:</b>\n\n"
@@ -150,6 +138,30 @@ class Statistics:
             f"<b>💰 Общие затраты за все время:</b> <code>${total_cost_all:.2f}</code>"
         )
 
+        text_stats += (f"\n\n<b>♻️ Кэш ответов:</b> <code>{Answers.n_hits}</code> попаданий, "
+                       f"<code>{Answers.n_misses}</code> промахов, "
+                       f"доля попаданий <code>{Answers.hit_rate:.0%}</code>")
+
+        text_stats += (f"\n<b>🎞 Кадры видео:</b> <code>{Frames.n_kept}</code> отправлено, "
+                       f"<code>{Frames.n_dropped}</code> отброшено как повторы")
+
+        video_report = VideoTimings.report()
+        if video_report:
+            text_stats += "\n\n<b>🎬 Этапы обработки видео:</b>\n"
+            for stage, timing in video_report.items():
+                text_stats += (f"<code>{stage}</code>: {timing['n']} раз, "
+                               f"ср. <code>{timing['avg_ms']:.0f}</code> мс, "
+                               f"p95 <code>{timing['p95_ms']:.0f}</code> мс\n")
+
+        latency_report = HttpClients.latency_report()
+        if latency_report:
+            text_stats += "\n\n<b>🌐 Задержки внешних сервисов:</b>\n"
+            for host, latency in latency_report.items():
+                text_stats += (f"<code>{host}</code>: {latency['n_requests']} запр., "
+                               f"ср. <code>{latency['avg_ms']:.0f}</code> мс, "
+                               f"p95 <code>{latency['p95_ms']:.0f}</code> мс, "
+                               f"ошибок <code>{latency['n_errors']}</code>\n")
+
         return {
             "token_usage_path": token_usage_path,
             "transcribed_seconds_path": transcribed_seconds_path,
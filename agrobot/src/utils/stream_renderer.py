@@ -0,0 +1,180 @@
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+
+from src.config import Config
+
+import asyncio
+import logging
+import re
+import time
+
+MESSAGE_LIMIT = 4096
+
+TELEGRAM_TAGS = {"b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+                 "span", "tg-spoiler", "a", "code", "pre", "blockquote", "tg-emoji"}
+TAG_RE = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9-]*)[^<>]*>")
+PARTIAL_TAG_RE = re.compile(r"<[^<>]*$")
+PARTIAL_ENTITY_RE = re.compile(r"&[a-zA-Z0-9#]*$")
+
+
+def trim_partial_markup(text: str):
+    text = PARTIAL_TAG_RE.sub("", text)
+    return PARTIAL_ENTITY_RE.sub("", text)
+
+
+def open_tags(text: str):
+    stack = []
+    for match in TAG_RE.finditer(text):
+        closing, name = match.group(1), match.group(2).lower()
+        if name not in TELEGRAM_TAGS:
+            continue
+
+        if not closing:
+            stack.append((name, match.group(0)))
+            continue
+
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] == name:
+                del stack[i:]
+                break
+    return stack
+
+
+def close_tags(text: str):
+    return text + "".join(f"</{name}>" for name, _ in reversed(open_tags(text)))
+
+
+def split_html(text: str, limit: int = MESSAGE_LIMIT):
+    chunks = []
+    reopen = ""
+
+    while text:
+        budget = limit - len(reopen) - 128
+        if len(text) <= budget:
+            piece, text = text, ""
+        else:
+            cut = text.rfind("\n", 0, budget)
+            if cut < budget // 2:
+                cut = text.rfind(" ", 0, budget)
+            if cut < budget // 2:
+                cut = budget
+
+            last_open = text.rfind("<", 0, cut)
+            if last_open > text.rfind(">", 0, cut):
+                cut = last_open
+            piece, text = text[:cut], text[cut:].lstrip("\n ")
+
+        chunk = reopen + piece
+        stack = open_tags(chunk)
+        chunks.append(chunk + "".join(f"</{name}>" for name, _ in reversed(stack)))
+        reopen = "".join(tag for _, tag in stack)
+
+    return chunks
+
+
+class StreamRenderer:
+    def __init__(self, bot: Bot, chat_id: int, message_id: int,
+                 edit_tokens: int = Config.stream_edit_tokens,
+                 edit_interval: float = Config.stream_edit_interval,
+                 min_edit_gap: float = Config.stream_min_edit_gap):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_ids = [message_id]
+        self.sent_chunks = [None]
+
+        self.edit_tokens = edit_tokens
+        self.edit_interval = edit_interval
+        self.min_edit_gap = min_edit_gap
+
+        self.text = ""
+        self.n_pending_tokens = 0
+        self.last_edit = 0.0
+        self.paused_until = 0.0
+
+    async def feed(self, delta: str):
+        self.text += delta
+        self.n_pending_tokens += 1
+
+        now = time.monotonic()
+        if now < self.paused_until or now - self.last_edit < self.min_edit_gap:
+            return
+
+        first_edit = self.sent_chunks[0] is None
+        if first_edit or self.n_pending_tokens >= self.edit_tokens or now - self.last_edit >= self.edit_interval:
+            await self._render(close_tags(trim_partial_markup(self.text)) + " ▌")
+
+    async def finish(self, text: str, reply_markup=None):
+        await self._render(text, reply_markup=reply_markup, final=True)
+
+    async def abort(self):
+        # keeps what was already streamed, without the cursor; an untouched placeholder is removed
+        if self.text:
+            await self.finish(close_tags(trim_partial_markup(self.text)))
+        else:
+            await self.delete()
+
+    async def delete(self):
+        for message_id in self.message_ids:
+            try:
+                await self.bot.delete_message(chat_id=self.chat_id, message_id=message_id)
+            except TelegramBadRequest:
+                pass
+        self.message_ids, self.sent_chunks = [], []
+
+    async def _render(self, text: str, reply_markup=None, final: bool = False):
+        chunks = split_html(text) or [text]
+
+        for i, chunk in enumerate(chunks):
+            markup = reply_markup if i == len(chunks) - 1 else None
+            if i < len(self.message_ids):
+                if chunk == self.sent_chunks[i] and markup is None:
+                    continue
+                # a rate-limited or rejected edit leaves the old text, so it must not count as sent
+                if await self._send(chunk, message_id=self.message_ids[i], reply_markup=markup, final=final) is None:
+                    continue
+            else:
+                message = await self._send(chunk, reply_markup=markup, final=final)
+                if message is None:
+                    return
+                self.message_ids.append(message.message_id)
+                self.sent_chunks.append(None)
+            self.sent_chunks[i] = chunk
+
+        if final:
+            for message_id in self.message_ids[len(chunks):]:
+                try:
+                    await self.bot.delete_message(chat_id=self.chat_id, message_id=message_id)
+                except TelegramBadRequest:
+                    pass
+            self.message_ids = self.message_ids[:len(chunks)]
+            self.sent_chunks = self.sent_chunks[:len(chunks)]
+
+        self.n_pending_tokens = 0
+        self.last_edit = time.monotonic()
+
+    async def _send(self, text: str, message_id: int = None, reply_markup=None, final: bool = False):
+        parse_mode = "HTML"
+        while True:
+            try:
+                if message_id is None:
+                    return await self.bot.send_message(chat_id=self.chat_id,
+                                                       text=text,
+                                                       parse_mode=parse_mode,
+                                                       reply_markup=reply_markup)
+                return await self.bot.edit_message_text(text=text,
+                                                        chat_id=self.chat_id,
+                                                        message_id=message_id,
+                                                        parse_mode=parse_mode,
+                                                        reply_markup=reply_markup)
+            except TelegramRetryAfter as e:
+                self.paused_until = time.monotonic() + e.retry_after
+                if not final:
+                    return None
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "message is not modified" in e.message:
+                    return True
+                if parse_mode is None:
+                    logging.warning(f"Stream render to {self.chat_id} failed: {e}")
+                    return None
+                parse_mode = None
@@ -1,11 +1,11 @@
 import base64
-import httpx
 import json
 
 from src.config import Config
 from src.exceptions import RegistrationError, RecurrentPaymentCheckError, \
     ConfirmPaymentError, PaymentCreationError
 from src.database import DataBase as db
+from src.http_client import HttpClients
 
 import asyncio
 from aiogram.types import Message
@@ -42,19 +42,16 @@ async def registr_user(url: str = "https://demo-api2.ckassa.ru/api-shop/user/reg
         'middleName': middlename,
     })
 
-    async with httpx.AsyncClient() as client:
+    reg_response = await HttpClients.request(method="POST",
+                                             url=url,
+                                             headers=headers,
+                                             data=payload)
 
-        reg_response = await client.request(method="POST",
-                                            url=url,
-                                            headers=headers,
-                                            data=payload,
-                                            timeout=None)
+    if reg_response.status_code == 200:
+        return reg_response.json()
 
-        if reg_response.status_code == 200:
-            return reg_response.json()
-
-        else:
-            raise RegistrationError
+    else:
+        raise RegistrationError
 
 
 async def get_active_user_cards(user_token: str,
@@ -69,21 +66,18 @@ async def get_active_user_cards(user_token: str,
         "userToken": user_token,
     })
 
-    async with httpx.AsyncClient() as client:
+    reg_response = await HttpClients.request(method="POST",
+                                             url=url,
+                                             headers=headers,
+                                             data=payload)
 
-        reg_response = await client.request(method="POST",
-                                            url=url,
-                                            headers=headers,
-                                            data=payload,
-                                            timeout=None)
+    if reg_response.status_code == 200:
+        cards_data = reg_response.json()
+        active_cards_tokens = [card["cardToken"] for card in cards_data["cards"] if card["state"] == "active"]
+        return active_cards_tokens
 
-        if reg_response.status_code == 200:
-            cards_data = reg_response.json()
-            active_cards_tokens = [card["cardToken"] for card in cards_data["cards"] if card["state"] == "active"]
-            return active_cards_tokens
-
-        else:
-            raise RecurrentPaymentCheckError
+    else:
+        raise RecurrentPaymentCheckError
 
 
 async def get_status_recurrent_payment(url: str = "https://demo-api2.ckassa.ru/api-shop/rs/shop/check/payment/state",
@@ -101,19 +95,16 @@ async def get_status_recurrent_payment(url: str = "https://demo-api2.ckassa.ru/a
         "regPayNum": reg_pay_num,
     })
 
-    async with httpx.AsyncClient() as client:
-
-        reg_response = await client.request(method="POST",
-                                            url=url,
-                                            headers=headers,
-                                            data=payload,
-                                            timeout=None)
+    reg_response = await HttpClients.request(method="POST",
+                                             url=url,
+                                             headers=headers,
+                                             data=payload)
 
-        if reg_response.status_code == 200:
-            return reg_response.json()
+    if reg_response.status_code == 200:
+        return reg_response.json()
 
-        else:
-            raise RecurrentPaymentCheckError
+    else:
+        raise RecurrentPaymentCheckError
 
 
 async def confirm_payment(url: str = "https://demo-api2.ckassa.ru/api-shop/provision-services/confirm",
@@ -132,19 +123,16 @@ async def confirm_payment(url: str = "https://demo-api2.ckassa.ru/api-shop/provi
         "orderId": order_id
     })
 
-    async with httpx.AsyncClient() as client:
-
-        reg_response = await client.request(method="POST",
-                                            url=url,
-                                            headers=headers,
-                                            data=payload,
-                                            timeout=None)
+    reg_response = await HttpClients.request(method="POST",
+                                             url=url,
+                                             headers=headers,
+                                             data=payload)
 
-        if reg_response.status_code == 200:
-            return reg_response.json()
+    if reg_response.status_code == 200:
+        return reg_response.json()
 
-        else:
-            raise ConfirmPaymentError
+    else:
+        raise ConfirmPaymentError
 
 
 async def create_new_recurrent_payment(user_id: int,
@@ -197,20 +185,17 @@ async def create_new_recurrent_payment(user_id: int,
             }
         ]
     })
-    async with httpx.AsyncClient() as client:
+    reg_response = await HttpClients.request(method="POST",
+                                             url=url,
+                                             headers=headers,
+                                             data=payload)
 
-        reg_response = await client.request(method="POST",
-                                            url=url,
-                                            headers=headers,
-                                            data=payload,
-                                            timeout=None)
+    if reg_response.status_code == 200:
+        data_rec_pay = reg_response.json()
+        return data_rec_pay
 
-        if reg_response.status_code == 200:
-            data_rec_pay = reg_response.json()
-            return data_rec_pay
-
-        else:
-            raise ConfirmPaymentError
+    else:
+        raise ConfirmPaymentError
 
 
 async def create_extend_recurrent_payment(user_id: int,
@@ -264,19 +249,16 @@ async def create_extend_recurrent_payment(user_id: int,
         ]
     })
 
-    async with httpx.AsyncClient() as client:
-
-        reg_response = await client.request(method="POST",
-                                            url=url,
-                                            headers=headers,
-                                            data=payload,
-                                            timeout=None)
+    reg_response = await HttpClients.request(method="POST",
+                                             url=url,
+                                             headers=headers,
+                                             data=payload)
 
-        if reg_response.status_code == 200:
-            data_rec_pay = reg_response.json()
-            return data_rec_pay
-        else:
-            raise ConfirmPaymentError
+    if reg_response.status_code == 200:
+        data_rec_pay = reg_response.json()
+        return data_rec_pay
+    else:
+        raise ConfirmPaymentError
 
 
 async def processing_payments(data_rec_pay: dict,
@@ -367,20 +349,17 @@ async def create_new_recurrent_payment_test(rate_name: str,
             }
         ]
     })
-    async with httpx.AsyncClient() as client:
-
-        reg_response = await client.request(method="POST",
-                                            url=url,
-                                            headers=headers,
-                                            data=payload,
-                                            timeout=None)
+    reg_response = await HttpClients.request(method="POST",
+                                             url=url,
+                                             headers=headers,
+                                             data=payload)
 
-        if reg_response.status_code == 200:
-            data_rec_pay = reg_response.json()
-            return data_rec_pay
+    if reg_response.status_code == 200:
+        data_rec_pay = reg_response.json()
+        return data_rec_pay
 
-        else:
-            raise ConfirmPaymentError
+    else:
+        raise ConfirmPaymentError
 
 if __name__ == "__main__":
     data = asyncio.run(create_new_recurrent_payment_test(rate_name="testPay"))
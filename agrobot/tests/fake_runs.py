@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+from typing import List
+import asyncio
+
+# put into a script to keep the stream open until the consuming task is cancelled
+HANG = object()
+
+
+def event(name: str, **data) -> SimpleNamespace:
+    return SimpleNamespace(event=name, data=SimpleNamespace(**data))
+
+
+def usage(n_input_tokens: int, n_output_tokens: int) -> SimpleNamespace:
+    return SimpleNamespace(prompt_tokens=n_input_tokens, completion_tokens=n_output_tokens)
+
+
+def delta_event(text: str) -> SimpleNamespace:
+    text_delta = SimpleNamespace(type="text", text=SimpleNamespace(value=text))
+    return event("thread.message.delta", delta=SimpleNamespace(content=[text_delta]))
+
+
+def text_events(text: str, run_id: str = "run_fake", chunk_size: int = 8,
+                n_input_tokens: int = 0, n_output_tokens: int = 0) -> List[SimpleNamespace]:
+    events = [event("thread.run.created", id=run_id, status="queued")]
+    events += [delta_event(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+
+    message_text = SimpleNamespace(type="text", text=SimpleNamespace(value=text, annotations=[]))
+    events.append(event("thread.message.completed", content=[message_text]))
+    events.append(event("thread.run.completed", id=run_id, status="completed",
+                        usage=usage(n_input_tokens, n_output_tokens)))
+    return events
+
+
+class FakeEventStream:
+    def __init__(self, events: List[SimpleNamespace]):
+        self.events = events
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for item in self.events:
+            if item is HANG:
+                await asyncio.Event().wait()
+            yield item
+
+
+# offline stand-in for client.beta.threads.runs: each create/submit call replays the next scripted event list
+class FakeRuns:
+    def __init__(self, scripts: List[list]):
+        self.scripts = list(scripts)
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(("create", kwargs))
+        return FakeEventStream(self.scripts.pop(0))
+
+    async def submit_tool_outputs(self, **kwargs):
+        self.calls.append(("submit_tool_outputs", kwargs))
+        return FakeEventStream(self.scripts.pop(0))
+
+    async def cancel(self, **kwargs):
+        self.calls.append(("cancel", kwargs))
@@ -0,0 +1,22 @@
+from src.nn.answer_cache import AnswerCache
+
+
+def test_normalize_drops_fillers_and_case():
+    assert AnswerCache.normalize("Подскажите, пожалуйста, Удобрение для томатов") == \
+        AnswerCache.normalize("удобрение для томатов")
+
+
+def test_normalize_keeps_word_order():
+    assert AnswerCache.normalize("удобрение для томатов после огурцов") != \
+        AnswerCache.normalize("удобрение для огурцов после томатов")
+
+
+def test_normalize_keeps_repeated_words():
+    assert AnswerCache.normalize("полив и еще раз полив") != AnswerCache.normalize("полив и еще раз")
+
+
+def test_key_depends_on_vector_stores():
+    cache = AnswerCache(max_prompt_length=300)
+    message = "чем подкормить огурцы"
+    assert cache._key(message, ["vs_a", "vs_b"]) == cache._key(message, ["vs_b", "vs_a"])
+    assert cache._key(message, ["vs_a"]) != cache._key(message, ["vs_a", "vs_b"])
@@ -0,0 +1,58 @@
+from src.nn.context_window import ContextWindow, message_text
+from src.nn.tokens import count_tokens
+
+
+def make_dialog(n_turns: int, text: str = "Как часто поливать томаты в теплице летом?"):
+    return [{"user": [{"type": "text", "text": f"{i}: {text}"}], "bot": f"{i}: ответ про полив. " * 5}
+            for i in range(n_turns)]
+
+
+def test_message_text_keeps_only_text_parts():
+    content = [{"type": "text", "text": "Вот кадры из видео:"},
+               {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,AAAA"}},
+               {"type": "text", "text": "что на листьях?"}]
+    assert message_text(content) == "Вот кадры из видео:\nчто на листьях?"
+    assert message_text("просто текст") == "просто текст"
+    assert message_text(None) == ""
+
+
+def test_count_turns_matches_per_message_count():
+    window = ContextWindow("gpt-4o", budget=10_000)
+    dialog = make_dialog(3)
+    expected = [window.count_message(turn["user"]) + window.count_message(turn["bot"]) for turn in dialog]
+    assert window.count_turns(dialog) == expected
+
+
+def test_fit_keeps_everything_under_budget():
+    dialog = make_dialog(5)
+    kept, n_removed = ContextWindow("gpt-4o", budget=100_000).fit(dialog)
+    assert kept == dialog
+    assert n_removed == 0
+
+
+def test_fit_drops_oldest_turns_first():
+    dialog = make_dialog(20)
+    window = ContextWindow("gpt-4o", budget=ContextWindow("gpt-4o").count_turns(dialog[:1])[0] * 5)
+    kept, n_removed = window.fit(dialog)
+
+    assert n_removed == len(dialog) - len(kept)
+    assert 0 < len(kept) <= 5
+    assert kept == dialog[n_removed:]
+    assert sum(window.count_turns(kept)) <= window.budget
+
+
+def test_fit_respects_reserved_tokens():
+    dialog = make_dialog(10)
+    window = ContextWindow("gpt-4o", budget=sum(ContextWindow("gpt-4o").count_turns(dialog)))
+
+    kept, n_removed = window.fit(dialog)
+    assert n_removed == 0
+
+    reserved = count_tokens("новый вопрос " * 50)
+    kept, n_removed = window.fit(dialog, reserved_tokens=reserved)
+    assert n_removed > 0
+    assert sum(window.count_turns(kept)) + reserved <= window.budget
+
+
+def test_fit_empty_dialog():
+    assert ContextWindow("gpt-4o").fit([]) == ([], 0)
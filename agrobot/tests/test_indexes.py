@@ -0,0 +1,44 @@
+from src.config import Config
+from src.database.indexes import INDEXES, QUERY_SHAPES, _plan_stages
+
+
+def index_keys(collection_name: str):
+    return [list(index.document["key"].keys()) for index in INDEXES.get(collection_name, [])]
+
+
+def test_ttl_indexes_expire_after_configured_seconds():
+    expected = {
+        ("dialog", "start_time"): Config.dialog_ttl,
+        ("payments", "created_at"): Config.payment_ttl,
+        ("answer_cache", "created_at"): Config.answer_cache_ttl,
+    }
+    ttl_indexes = {}
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            document = index.document
+            if "expireAfterSeconds" in document:
+                # mongo only expires documents through single-field date indexes
+                assert len(document["key"]) == 1
+                assert document["name"].endswith("_ttl")
+                ttl_indexes[(collection_name, next(iter(document["key"])))] = document["expireAfterSeconds"]
+
+    assert ttl_indexes == expected
+    assert all(seconds > 0 for seconds in ttl_indexes.values())
+
+
+def test_every_query_shape_has_an_index():
+    for collection_name, query, allow_collscan in QUERY_SHAPES:
+        if allow_collscan:
+            assert query == {}
+            continue
+
+        leading_field = next(iter(query))
+        assert leading_field == "_id" or [leading_field] in [keys[:1] for keys in index_keys(collection_name)], \
+            f"{collection_name} {query} has no index"
+
+
+def test_plan_stages_walks_nested_inputs():
+    plan = {"stage": "FETCH",
+            "inputStage": {"stage": "OR",
+                           "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]}}
+    assert _plan_stages(plan) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
@@ -0,0 +1,136 @@
+from types import SimpleNamespace
+import asyncio
+import json
+
+import pytest
+
+from src.nn.run_executor import RunExecutor, RunError
+from tests.fake_runs import FakeRuns, HANG, delta_event, event, text_events, usage
+
+
+def tool_call(call_id: str, name: str, arguments: str):
+    return SimpleNamespace(id=call_id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
+def requires_action(run_id: str, tool_calls: list):
+    action = SimpleNamespace(submit_tool_outputs=SimpleNamespace(tool_calls=tool_calls))
+    return event("thread.run.requires_action", id=run_id, status="requires_action", required_action=action)
+
+
+def step_event(name: str, step_id: str = "step_1", status: str = "in_progress"):
+    return event(name, id=step_id, status=status, delta=SimpleNamespace(step_details=None))
+
+
+def test_text_deltas_are_streamed_and_counted():
+    runs = FakeRuns([text_events("Поливайте томаты утром.", chunk_size=5, n_input_tokens=12, n_output_tokens=7)])
+    deltas = []
+
+    async def on_delta(delta: str):
+        deltas.append(delta)
+
+    result = asyncio.run(RunExecutor(runs).run("thread_1", "asst_1", on_delta=on_delta))
+
+    assert "".join(deltas) == "Поливайте томаты утром."
+    assert result.text == "Поливайте томаты утром."
+    assert (result.run_id, result.status) == ("run_fake", "completed")
+    assert (result.n_input_tokens, result.n_output_tokens) == (12, 7)
+    assert runs.calls[0][1]["stream"] is True
+
+
+def test_requires_action_submits_tool_outputs_and_continues():
+    calls = []
+
+    async def get_weather(city: str):
+        calls.append(city)
+        return {"city": city, "t": 21}
+
+    runs = FakeRuns([
+        [event("thread.run.created", id="run_1", status="queued"),
+         requires_action("run_1", [tool_call("call_1", "get_weather", '{"city": "Краснодар"}')])],
+        text_events("Тепло.", run_id="run_1")
+    ])
+    result = asyncio.run(RunExecutor(runs, tools={"get_weather": get_weather}).run("thread_1", "asst_1"))
+
+    assert calls == ["Краснодар"]
+    name, kwargs = runs.calls[1]
+    assert name == "submit_tool_outputs"
+    assert kwargs["run_id"] == "run_1"
+    assert [output["tool_call_id"] for output in kwargs["tool_outputs"]] == ["call_1"]
+    assert json.loads(kwargs["tool_outputs"][0]["output"]) == {"city": "Краснодар", "t": 21}
+    assert result.text == "Тепло."
+
+
+def test_step_events_do_not_replace_run_state():
+    events = text_events("Ответ", run_id="run_1")
+    events[1:1] = [step_event("thread.run.step.created"), step_event("thread.run.step.delta", status=None),
+                   step_event("thread.run.step.completed", status="completed")]
+    result = asyncio.run(RunExecutor(FakeRuns([events])).run("thread_1", "asst_1"))
+
+    assert (result.run_id, result.status) == ("run_1", "completed")
+    assert result.text == "Ответ"
+
+
+def test_incomplete_run_keeps_partial_answer():
+    details = SimpleNamespace(reason="max_completion_tokens")
+    runs = FakeRuns([[event("thread.run.created", id="run_1", status="queued"),
+                      delta_event("Частичный ответ"),
+                      event("thread.run.incomplete", id="run_1", status="incomplete",
+                            incomplete_details=details, usage=usage(30, 10))]])
+    result = asyncio.run(RunExecutor(runs).run("thread_1", "asst_1"))
+
+    assert result.text == "Частичный ответ"
+    assert result.status == "incomplete"
+    assert (result.n_input_tokens, result.n_output_tokens) == (30, 10)
+
+
+def test_incomplete_run_without_text_fails():
+    runs = FakeRuns([[event("thread.run.incomplete", id="run_1", status="incomplete",
+                            incomplete_details=None, usage=None)]])
+    with pytest.raises(RunError):
+        asyncio.run(RunExecutor(runs).run("thread_1", "asst_1"))
+
+
+def test_failed_run_raises():
+    error = SimpleNamespace(message="rate_limit_exceeded")
+    runs = FakeRuns([[event("thread.run.created", id="run_1", status="queued"),
+                      event("thread.run.failed", id="run_1", status="failed", last_error=error)]])
+    with pytest.raises(RunError, match="rate_limit_exceeded"):
+        asyncio.run(RunExecutor(runs).run("thread_1", "asst_1"))
+
+
+def test_cancel_targets_run_seen_in_stream():
+    runs = FakeRuns([[event("thread.run.created", id="run_1", status="queued"),
+                      event("thread.run.in_progress", id="run_1", status="in_progress"),
+                      step_event("thread.run.step.created", step_id="step_9"),
+                      delta_event("Начало"),
+                      HANG]])
+
+    async def cancel_mid_stream():
+        task = asyncio.create_task(RunExecutor(runs).run("thread_1", "asst_1"))
+        while not any(name == "create" for name, _ in runs.calls):
+            await asyncio.sleep(0)
+        for _ in range(10):
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_mid_stream())
+
+    assert runs.calls[-1] == ("cancel", {"thread_id": "thread_1", "run_id": "run_1"})
+
+
+def test_finished_run_is_not_cancelled():
+    runs = FakeRuns([text_events("Готово", run_id="run_1") + [HANG]])
+
+    async def cancel_after_completion():
+        task = asyncio.create_task(RunExecutor(runs).run("thread_1", "asst_1"))
+        for _ in range(20):
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_after_completion())
+
+    assert all(name != "cancel" for name, _ in runs.calls)
@@ -0,0 +1,27 @@
+import pytest
+
+from src.nn.voice_intent import VoiceIntentDetector
+from tests.voice_intent_cases import VOICE_INTENT_CASES
+
+
+@pytest.fixture(scope="module")
+def detector():
+    return VoiceIntentDetector()
+
+
+@pytest.mark.parametrize("message, expected", VOICE_INTENT_CASES)
+def test_labeled_case(detector, message, expected):
+    is_voice, _ = detector(message)
+    assert is_voice == expected
+
+
+@pytest.mark.parametrize("message", ["не отвечай голосом", "без озвучки", "не надо мне аудио"])
+def test_negation_is_confident_text(detector, message):
+    is_voice, confidence = detector(message)
+    assert not is_voice
+    assert confidence >= 0.8
+
+
+def test_ambiguous_voice_word_defers_to_llm(detector):
+    _, confidence = detector("у бычка пропал голос")
+    assert confidence < 0.8
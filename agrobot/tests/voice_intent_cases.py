@@ -0,0 +1,36 @@
+# (message, expects a voice answer)
+VOICE_INTENT_CASES = [
+    ("Ответь голосом, как избавиться от клеща", True),
+    ("расскажи голосом про подкормку томатов", True),
+    ("Скажи мне вслух, когда сажать чеснок", True),
+    ("озвучь ответ пожалуйста", True),
+    ("Можешь озвучить, чем обработать виноград?", True),
+    ("пришли голосовое сообщение с ответом", True),
+    ("хочу аудио ответ про полив огурцов", True),
+    ("Объясни голосом, почему желтеют листья", True),
+    ("продиктуй вслух дозировку удобрения", True),
+    ("запиши войс, я за рулём", True),
+    ("Прочитай вслух инструкцию к фунгициду", True),
+    ("ответ голосовым, пожалуйста", True),
+    ("не знаю что делать, ответь голосом", True),
+    ("Как избавиться от клеща", False),
+    ("Когда сажать картофель в Подмосковье?", False),
+    ("Чем обработать яблоню от парши", False),
+    ("не отвечай голосом", False),
+    ("Не надо озвучивать, просто напиши", False),
+    ("без озвучки, пожалуйста", False),
+    ("не нужно мне аудио, ответь текстом", False),
+    ("ответь текстом, голосом неудобно", False),
+    ("Напиши письменно норму внесения азота", False),
+    ("только текст, без голосовых", False),
+    ("нельзя голосом, я на совещании", False),
+    ("голос пропал после болезни, это не про растения но всё же", False),
+    ("У коровы хриплый голос, что делать?", False),
+    ("Какие аудиокниги по агрономии посоветуешь?", False),
+    ("Посоветуй сорт томатов для теплицы", False),
+    ("Какая температура нужна для прорастания пшеницы", False),
+    ("Почему у огурцов горькие плоды?", False),
+    ("Сколько раз поливать капусту в жару", False),
+    ("Что такое севооборот", False),
+    ("", False),
+]